@@ -0,0 +1,211 @@
+# Benchmarks for the Data Catalog.
+# Run this using `python3 benchmark.py` from the datacatalog directory.
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import sqlite3 as db
+import pickle
+import random
+from datetime import datetime
+import profiler
+from models import Datasets, Dataset, Table, Column
+from search import SearchIndex
+
+def timeit(fn, repeat: int = 5) -> float:
+    """Returns the best wall time in seconds over `repeat` runs"""
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def legacy_refresh(conn: db.Connection) -> int:
+    """The original refresh() loop: a COUNT(*), a sample and one stats query per column. Returns the number of queries."""
+    queries = 1
+    tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table'", conn)
+
+    for table_name in tables['name']:
+        columns = pd.read_sql_query(f"PRAGMA table_info('{table_name}')", conn)
+        columns = columns[~columns['name'].isin(profiler.EXCLUDED_COLUMNS)]
+        pd.read_sql_query(f"SELECT * FROM \"{table_name}\" LIMIT 10", conn)
+        pd.read_sql_query(f"SELECT COUNT(*) as cnt FROM \"{table_name}\"", conn)
+        queries += 3
+
+        for label, col in columns.iterrows():
+            name = profiler.quote_identifier(col['name'])
+            pd.read_sql_query(f"SELECT MIN({name}) as min, MAX({name}) as max, AVG({name}) as mean, COUNT(DISTINCT {name}) as num_distinct, COUNT({name}) as num_rows, COUNT(*) as num_rows FROM \"{table_name}\"", conn)
+            queries += 1
+
+    return queries
+
+def single_pass_refresh(conn: db.Connection) -> int:
+    """The profiler: PRAGMA table_info, the aggregate query and one streaming pass per table. Returns the number of queries."""
+    queries = 1
+
+    for table_name in profiler.get_table_names(conn):
+        profiler.profile_table(conn, table_name)
+        queries += 3
+
+    return queries
+
+def bench_profiling(path: str = 'northwind.db') -> None:
+    conn = db.connect(path)
+
+    legacy_queries = legacy_refresh(conn)
+    single_pass_queries = single_pass_refresh(conn)
+
+    legacy = timeit(lambda: legacy_refresh(conn))
+    single_pass = timeit(lambda: single_pass_refresh(conn))
+
+    print(f"Profiling {path}")
+    print(f"  per-column loop: {legacy * 1000:8.1f} ms ({legacy_queries} queries)")
+    print(f"  single pass:     {single_pass * 1000:8.1f} ms ({single_pass_queries} queries)")
+    print(f"  speedup:         {legacy / single_pass:8.1f}x")
+
+def large_table(path: str, num_rows: int = 500000) -> None:
+    """An orders-like table of 10 columns: an integer key, skewed integer and REAL columns with some NULLs,
+    and TEXT columns with from a handful to 50k distinct values"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'id': np.arange(num_rows),
+        'customer_id': rng.zipf(1.5, num_rows) % 100000,
+        'quantity': rng.integers(1, 100, num_rows),
+        'amount': rng.lognormal(3, 1, num_rows).round(2),
+        'discount': rng.choice([0, 0.05, 0.1, 0.15, 0.2, 0.25], num_rows),
+        'category': [f"category_{i}" for i in rng.zipf(1.3, num_rows) % 50000],
+        'status': rng.choice(["new", "paid", "shipped", "delivered", "returned"], num_rows),
+        'country': [f"country_{i}" for i in rng.integers(0, 60, num_rows)],
+        'order_date': (np.datetime64('2015-01-01') + rng.integers(0, 3000, num_rows)).astype(str),
+        'note': [None if i % 10 else f"note {i}" for i in range(num_rows)],
+    })
+    df.loc[df.index % 97 == 0, 'amount'] = None
+
+    with db.connect(path) as conn:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, customer_id INTEGER, quantity INTEGER, amount REAL, discount REAL, category TEXT, status TEXT, country TEXT, order_date TEXT, note TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", df.astype(object).where(df.notna(), None).itertuples(index=False))
+
+def bench_large_table(num_rows: int = 1000000, worker_counts: tuple = (1, 2, 4, 8)) -> None:
+    """Profiling one large table: the original per-column loop, the aggregate query alone, the profiler on one connection
+    with sketches and exact, and the profiler splitting the table over a process pool"""
+    path = os.path.join(tempfile.mkdtemp(), "large.db")
+    large_table(path, num_rows)
+    conn = db.connect(path)
+    column_names = list(profiler.get_columns(conn, 't')['name'])
+
+    legacy = timeit(lambda: legacy_refresh(conn), repeat=1)
+    aggregate = timeit(lambda: profiler.profile_columns(conn, 't', column_names), repeat=1)
+    sketched = timeit(lambda: profiler.profile_table(conn, 't'), repeat=1)
+    exact = timeit(lambda: profiler.profile_table(conn, 't', exact_max_rows=None), repeat=1)
+
+    estimates = profiler.profile_table(conn, 't')['stats']
+    exact_stats = profiler.profile_table(conn, 't', exact_max_rows=None)['stats']
+
+    print(f"Profiling a table of {num_rows} rows and {len(column_names)} columns ({os.cpu_count()} CPUs)")
+    print(f"  per-column loop:         {legacy * 1000:8.1f} ms (MIN/MAX/AVG and COUNT(DISTINCT))")
+    print(f"  aggregate query only:    {aggregate * 1000:8.1f} ms (MIN/MAX/AVG)")
+    print(f"  single pass, sketches:   {sketched * 1000:8.1f} ms (everything)")
+    print(f"  single pass, exact:      {exact * 1000:8.1f} ms (everything)")
+
+    for workers in worker_counts:
+        elapsed = timeit(lambda: profiler.profile_tables(path, ['t'], max_workers=workers, executor="process"), repeat=1)
+        print(f"  process x{workers}, sketches:  {elapsed * 1000:8.1f} ms ({legacy / elapsed:.1f}x the per-column loop)")
+
+    for name in ['customer_id', 'amount', 'category', 'order_date']:
+        print(f"  {name:11} distinct ~{estimates[name]['num_distinct']} (exact {exact_stats[name]['num_distinct']}), quantiles {estimates[name]['quantiles']} (exact {exact_stats[name]['quantiles']})")
+
+def bench_parallel(path: str = 'northwind.db', worker_counts: tuple = (1, 2, 4, 8)) -> None:
+    table_names = profiler.get_table_names(db.connect(path))
+
+    print(f"Parallel profiling {path} ({len(table_names)} tables)")
+
+    for executor in ("thread", "process"):
+        baseline = None
+
+        for workers in worker_counts:
+            elapsed = timeit(lambda: profiler.profile_tables(path, table_names, max_workers=workers, executor=executor), repeat=3)
+            baseline = baseline or elapsed
+            print(f"  {executor:7} x{workers}: {elapsed * 1000:8.1f} ms ({baseline / elapsed:.1f}x)")
+
+def synthetic_catalog(num_tables: int = 10000) -> Datasets:
+    dset = Dataset(name='synthetic', readable_name='Synthetic', description='', tables=[])
+
+    for i in range(num_tables):
+        dset.add_table(Table(name=f"table_{i}", readable_name=f"Table {i}", description='', last_updated=datetime.now(), type='', columns=[], sample=None, row_count=0))
+
+    dsets = Datasets(datasets=[])
+    dsets.add_dataset(dset)
+
+    return dsets
+
+def linear_table_index(dset: Dataset, table_name: str) -> int:
+    """The original Dataset.get_table_index()"""
+    for i in range(len(dset.tables)):
+        if dset.tables[i].name == table_name:
+            return i
+
+    return -1
+
+def bench_lookup(num_tables: int = 10000, num_lookups: int = 1000) -> None:
+    dsets = synthetic_catalog(num_tables)
+    dset = dsets.get_dataset('synthetic')
+    names = [f"table_{random.randrange(num_tables)}" for _ in range(num_lookups)]
+
+    linear = timeit(lambda: [linear_table_index(dset, name) for name in names])
+    indexed = timeit(lambda: [dset.get_table_index(name) for name in names])
+    # e.g. a bad table_name on /table_detail
+    missing = timeit(lambda: [dset.get_table_index(f"missing_{i}") for i in range(num_lookups)])
+
+    # The index is rebuilt when the catalog is unpickled
+    reloaded = pickle.loads(pickle.dumps(dsets)).get_dataset('synthetic')
+    assert reloaded.get_table_index(names[0]) == dset.get_table_index(names[0])
+
+    print(f"Table lookup in a catalog of {num_tables} tables ({num_lookups} lookups)")
+    print(f"  linear scan: {linear * 1e6 / num_lookups:8.2f} us/lookup")
+    print(f"  name index:  {indexed * 1e6 / num_lookups:8.2f} us/lookup")
+    print(f"  not found:   {missing * 1e6 / num_lookups:8.2f} us/lookup")
+
+WORDS = ["customer", "order", "product", "invoice", "shipment", "region", "supplier", "employee", "payment", "account",
+         "date", "amount", "price", "quantity", "status", "code", "name", "address", "country", "discount"]
+
+def synthetic_columns_catalog(num_tables: int = 10000, columns_per_table: int = 10) -> Datasets:
+    rng = random.Random(0)
+    dsets = synthetic_catalog(num_tables)
+
+    for table in dsets.get_dataset('synthetic').tables:
+        table.description = " ".join(rng.sample(WORDS, 3))
+
+        for i in range(columns_per_table):
+            name = "".join(word.title() for word in rng.sample(WORDS, 2)) + str(i)
+            table.columns.append(Column(name=name, readable_name=name, description=" ".join(rng.sample(WORDS, 4)), data_type='TEXT', nullable='Nullable', min=None, max=None, mean=None, num_distinct=None, num_null=None, num_rows=None))
+
+    return dsets
+
+def bench_search(num_tables: int = 10000, columns_per_table: int = 10) -> None:
+    dsets = synthetic_columns_catalog(num_tables, columns_per_table)
+    dset = dsets.get_dataset('synthetic')
+    index = SearchIndex()
+
+    build = timeit(lambda: index.build(dsets), repeat=1)
+
+    print(f"Search over {num_tables * columns_per_table} columns (index built in {build:.2f}s)")
+
+    for query in ["customer", "customer amount", "shipment cou", "order3", "nothing here"]:
+        elapsed = timeit(lambda: index.search(query))
+        print(f"  {query!r:18}: {elapsed * 1000:8.2f} ms")
+
+    table = dset.tables[0]
+    table.description = "edited description"
+    update = timeit(lambda: index.update_table(dset, table))
+    print(f"  update one table: {update * 1000:8.2f} ms")
+
+if __name__ == "__main__":
+    bench_profiling()
+    bench_large_table()
+    bench_parallel()
+    bench_lookup()
+    bench_search()
@@ -0,0 +1,112 @@
+# Background jobs for the Data Catalog.
+# Long running work (like a refresh) runs on a background thread instead of a gunicorn
+# request thread. Pages start a job, then poll its progress by job id and can cancel it.
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = "queued"
+        self.message = ""
+        self.error = None
+        self.total = 0
+        # One dict per finished item, e.g. a profiled table and how long it took
+        self.progress = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled()
+
+    def add_progress(self, item: dict) -> None:
+        with self.lock:
+            self.progress.append(item)
+
+    @property
+    def done(self) -> int:
+        return len(self.progress)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "cancelled", "failed")
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0
+
+        return (self.finished_at or time.time()) - self.started_at
+
+class JobRunner:
+    """Runs jobs on a bounded pool of background threads and remembers the most recent ones"""
+    def __init__(self, max_workers: int = 1, max_jobs: int = 20):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, name: str, fn) -> Job:
+        """Runs fn(job) in the background and returns the job right away"""
+        job = Job(name)
+
+        with self.lock:
+            self.jobs[job.id] = job
+
+            # Forget the oldest finished jobs
+            for job_id in [job_id for job_id, old in self.jobs.items() if old.finished][:max(0, len(self.jobs) - self.max_jobs)]:
+                del self.jobs[job_id]
+
+        self.executor.submit(self._run, job, fn)
+
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def active(self, name: str) -> Job | None:
+        """The queued or running job with this name, if any"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.name == name and not job.finished:
+                    return job
+
+        return None
+
+    def _run(self, job: Job, fn) -> None:
+        job.started_at = time.time()
+        job.status = "running"
+
+        try:
+            job.check_cancelled()
+            fn(job)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = "cancelled" if job.cancelled else "failed"
+        finally:
+            job.finished_at = time.time()
@@ -6,123 +6,104 @@ import sqlite3 as db
 from dataclasses import dataclass, asdict
 from typing import List
 from datetime import datetime
+import functools
 import json
+import os
+import threading
+import time
+from contextlib import closing
+import jobs
+import profiler
+import store
+from search import SearchIndex
 
 # HELPER FUNCTIONS
 app = cob.App("Data Catalog", use_built_in_auth=True)
 
-# Change this to a connection to your database
-conn = db.connect('northwind.db', check_same_thread=False)
+# Change this to the path of your database. Refresh opens its own connections to it.
+database_path = 'northwind.db'
 
-# DATA MODEL
-# Python @dataclass is a new feature in Python 3.7 that allows you to define a class with a bunch of attributes and their types.
-# It just makes it easier to define a class with a bunch of attributes without having to define the __init__ method.
-@dataclass
-class Datasets:
-    datasets: list[Dataset]
+# Number of tables (or parts of large tables) profiled concurrently during refresh, each with its own read-only connection.
+# Profiling is mostly Python work that holds the GIL, so it runs in a process pool. Set profile_executor to "thread"
+# for a thread pool, which starts faster and can interrupt running queries on cancel but doesn't scale with cores.
+profile_workers = os.cpu_count() or 1
+profile_executor = "process"
 
-    def to_dataframe(self) -> pd.DataFrame:
-        records = []
+# Tables with more rows than this get estimated distinct counts, quantiles and most frequent values
+# from bounded-memory sketches. Set it to None to always compute them exactly.
+profile_exact_max_rows = 10000
 
-        for dataset in self.datasets:
-            records.extend(dataset.to_dataframe().to_dict('records'))
-        
-        return pd.DataFrame(records)
-
-    def get_dataset_index(self, dataset_name: str) -> int:
-        for i in range(len(self.datasets)):
-            if self.datasets[i].name == dataset_name:
-                return i
-
-        return -1
-
-@dataclass
-class Dataset:
-    name: str
-    readable_name: str
-    description: str
-    tables: list[Table]
-
-    def to_dataframe(self) -> pd.DataFrame:
-        records = []
-
-        for table in self.tables:
-            row = {}
-            row['dataset_name'] = self.name
-            row['dataset_readable_name'] = self.readable_name
-            row['dataset_description'] = self.description
-            row['table_name'] = table.name
-            row['table_readable_name'] = table.readable_name
-            row['table_description'] = table.description
-            row['row_count'] = table.row_count
-            row['table_last_updated'] = table.last_updated.strftime("%Y-%m-%d %H:%M")
-            row['table_type'] = table.type
-            
-            records.append(row)
-        
-        return pd.DataFrame(records)
-
-    def get_table_index(self, table_name: str) -> int:
-        for i in range(len(self.tables)):
-            if self.tables[i].name == table_name:
-                return i
-
-        return -1
-
-@dataclass
-class Table:
-    name: str
-    readable_name: str
-    description: str
-    last_updated: datetime
-    type: str
-    columns: list[Column]
-    sample: pd.DataFrame
-    row_count: int
-
-    def to_dataframe(self) -> pd.DataFrame:
-        records = []
-
-        for column in self.columns:
-            row = {}
-            row['column_name'] = column.name
-            row['column_readable_name'] = column.readable_name
-            row['column_description'] = column.description
-            row['column_data_type'] = column.data_type
-            row['column_nullable'] = column.nullable
-            row['column_min'] = column.min
-            row['column_max'] = column.max
-            row['column_mean'] = column.mean
-            row['column_num_distinct'] = column.num_distinct
-            row['column_num_null'] = column.num_null
-            row['column_num_rows'] = column.num_rows
-            
-            records.append(row)
-        
-        return pd.DataFrame(records)
-
-@dataclass
-class Column:
-    name: str
-    readable_name: str
-    description: str
-    data_type: str
-    nullable: bool
-    min: float
-    max: float
-    mean: float
-    num_distinct: int
-    num_null: int
-    num_rows: int
+# DATA MODEL
+# The data model lives in models.py. Importing it here also lets catalogs pickled
+# when the model was defined in this file load as before.
+from models import Datasets, Dataset, Table, Column
+
+# METADATA STORE
+# The catalog is kept in a local SQLite file, so saving an edit only writes the rows of the edited table.
+# Use store.CloudPickleStore(app, "northwind.pkl") instead to keep the whole catalog in a PyCob cloud pickle.
+metadata_store = store.SQLiteStore('catalog.db')
 
 # PyCob has a built-in cloud pickle feature that allows you to save and load objects to the cloud.
-dsets: Datasets
-try:
-    print("Loading from cloud pickle")
-    dsets = app.from_cloud_pickle("northwind.pkl")
-except Exception as e:
-    print(f"Error getting cloud pickle {e}")
-    dsets = None
+# It is used to export and import the catalog.
+cloud_pickle = store.CloudPickleStore(app, "northwind.pkl")
+
+# Search index over the catalog metadata, rebuilt whenever the whole catalog changes
+search_index = SearchIndex()
+
+# Refreshes run in the background, one at a time
+refresh_jobs = jobs.JobRunner(max_workers=1)
+# Held while checking for a running refresh and starting one, so two requests can't both start one
+refresh_lock = threading.Lock()
+# Held by edits and by a refresh while it saves the catalog, so a refresh can't save over an edit
+edit_lock = threading.Lock()
+
+# The catalog is loaded on first use rather than at startup
+dsets: Datasets = None
+dsets_loaded = False
+dsets_lock = threading.Lock()
+
+def get_datasets() -> Datasets | None:
+    global dsets, dsets_loaded
+
+    with dsets_lock:
+        if not dsets_loaded:
+            dsets = metadata_store.load()
+
+            # First start with an empty store: import the catalog from the cloud pickle if there is one
+            if dsets is None:
+                try:
+                    print("Importing from cloud pickle")
+                    dsets = cloud_pickle.load()
+                    save_datasets(dsets)
+                except Exception as e:
+                    print(f"Error getting cloud pickle {e}")
+                    dsets = None
+
+            search_index.build(dsets)
+            dsets_loaded = True
+
+    return dsets
+
+def save_datasets(dsets: Datasets) -> None:
+    metadata_store.save(dsets)
+
+    # Once saved, samples are read from the store when a table is viewed instead of being kept in memory
+    if metadata_store.lazy_samples:
+        for dset in dsets.datasets:
+            for table in dset.tables:
+                table.sample = None
+
+        load_sample.cache_clear()
+
+@functools.lru_cache(maxsize=128)
+def load_sample(dataset_name: str, table_name: str) -> pd.DataFrame | None:
+    return metadata_store.load_sample(dataset_name, table_name)
+
+def get_sample(dset: Dataset, table: Table) -> pd.DataFrame | None:
+    if table.sample is not None:
+        return table.sample
+
+    return load_sample(dset.name, table.name)
 
 def to_readable_name(name: str) -> str:
     import re
@@ -131,8 +112,56 @@ def to_readable_name(name: str) -> str:
 
     return name.replace("_", " ").title()
 
+def table_from_profile(profile: dict) -> Table:
+    table = Table(name=profile['name'], readable_name=to_readable_name(profile['name']), description='', last_updated=datetime.now(), type='', columns=[], sample=profile['sample'], row_count=profile['row_count'])
+
+    # Get column metadata
+    for label, col in profile['columns'].iterrows():
+        stats = profile['stats'].get(col['name']) or {}
+
+        column = Column(name=col['name'], readable_name=to_readable_name(col['name']), description='', data_type=col['type'], nullable='Nullable' if col['notnull']==0 else 'Not Nullable', min=stats.get('min'), max=stats.get('max'), mean=stats.get('mean'), num_distinct=stats.get('num_distinct'), num_null=stats.get('num_null'), num_rows=stats.get('num_rows'), distinct_is_estimate=stats.get('distinct_is_estimate', False), quantiles=stats.get('quantiles'), top_values=stats.get('top_values'))
+
+        table.columns.append(column)
+
+    return table
+
+def merge_metadata(old: Table, new: Table) -> Table:
+    """Keeps the metadata edited on the old table (and its columns) on a freshly profiled table"""
+    new.readable_name = old.readable_name
+    new.description = old.description
+    new.type = old.type
+
+    old_columns = {column.name: column for column in old.columns}
+
+    for column in new.columns:
+        if column.name in old_columns:
+            column.readable_name = old_columns[column.name].readable_name
+            column.description = old_columns[column.name].description
+
+    return new
+
+def keep_saved_edits(dset: Dataset) -> None:
+    """Copies the names, descriptions and types saved in the metadata store onto a freshly refreshed dataset"""
+    saved = metadata_store.load()
+    saved_dset = saved.get_dataset(dset.name) if saved is not None else None
+
+    if saved_dset is None:
+        return
+
+    dset.readable_name = saved_dset.readable_name
+    dset.description = saved_dset.description
+
+    for table in dset.tables:
+        saved_table = saved_dset.get_table(table.name)
+
+        if saved_table is not None:
+            merge_metadata(saved_table, table)
+
 def update_dataset(params: dict) -> None:
-    global dsets
+    dsets = get_datasets()
+
+    if dsets is None:
+        return None
 
     # Parameters are of the form
     # /update?dataset_name=northwind&table_name=Categories&dataset_readable_name=Northwind&table_readable_name=Categories&table_type=Dimension&table_description=Description&column_CategoryID_readable_name=Category+ID&column_CategoryID_description=test+1&column_CategoryName_readable_name=Category+Name&column_CategoryName_description=test+2&column_Description_readable_name=Description&column_Description_description=test+3&column_Picture_readable_name=Picture&column_Picture_description=test+4
@@ -144,19 +173,15 @@ def update_dataset(params: dict) -> None:
     table_type = params.get("table_type")
     table_description = params.get("table_description")
 
-    dataset_index = dsets.get_dataset_index(dataset_name)
+    dset = dsets.get_dataset(dataset_name)
 
-    if dataset_index == -1:
+    if dset is None:
         return None
-    
-    dset = dsets.datasets[dataset_index]
 
-    table_index = dset.get_table_index(table_name)
+    table = dset.get_table(table_name)
 
-    if table_index == -1:
+    if table is None:
         return None
-    
-    table = dset.tables[table_index]
 
     # Update the table
     table.readable_name = table_readable_name
@@ -172,7 +197,12 @@ def update_dataset(params: dict) -> None:
         column.readable_name = params.get(f"column_{column.name}_readable_name")
         column.description = params.get(f"column_{column.name}_description")                    
 
-    app.to_cloud_pickle(dsets, "northwind.pkl")
+    # Patch the cached /tables listing instead of rebuilding it
+    dsets.update_table_row(dset, table)
+    search_index.update_table(dset, table)
+
+    # Only the rows of this table are written
+    metadata_store.save_table(dsets, dset, table)
 
 
 # PAGE FUNCTIONS
@@ -180,6 +210,8 @@ def tables(server_request: cob.Request) -> cob.Page:
     page = cob.Page("Tables")
     page.add_header("Tables")
 
+    dsets = get_datasets()
+
     if dsets is None:
         page.add_alert("Refresh required", "Error", "red")
         return page
@@ -193,10 +225,44 @@ def tables(server_request: cob.Request) -> cob.Page:
     
     return page
     
+def search(server_request: cob.Request) -> cob.Page:
+    page = cob.Page("Search")
+    page.add_header("Search")
+
+    query = server_request.params("q")
+
+    with page.add_form(action="/search") as form:
+        form.add_formtext("Search datasets, tables and columns", "q", placeholder="e.g. customer id", value=query)
+        form.add_formsubmit("Search")
+
+    if get_datasets() is None:
+        page.add_alert("Refresh required", "Error", "red")
+        return page
+
+    if query is None or query == "":
+        return page
+
+    start = time.perf_counter()
+    results = search_index.search(query)
+    elapsed = time.perf_counter() - start
+
+    page.add_text(f"{len(results)} results in {elapsed * 1000:.1f} ms")
+
+    if results:
+        action_buttons = [
+            cob.Rowaction(label="View", url="/table_detail?dataset_name={dataset_name}&table_name={table_name}", open_in_new_window=False),
+        ]
+
+        page.add_pandastable(pd.DataFrame(results), hide_fields=["score"], action_buttons=action_buttons)
+
+    return page
+
 def table_detail(server_request: cob.Request) -> cob.Page:
     page = cob.Page("Table Detail")
     dataset_name = server_request.params("dataset_name")
     table_name = server_request.params("table_name")
+
+    dsets = get_datasets()
     
     if dsets is None:
         page.add_alert("Refresh required", "Error", "red")
@@ -223,8 +289,8 @@ def table_detail(server_request: cob.Request) -> cob.Page:
         page.add_alert("Table not found", "Error", "red")
         return page
 
-    table_df = dset.to_dataframe().iloc[table_index,:].reset_index()
     table = dset.tables[table_index]
+    table_df = pd.Series(dset.table_record(table)).reset_index()
 
     table_df.columns = ["Field", "Value"]
     # Make the field names more readable
@@ -235,8 +301,16 @@ def table_detail(server_request: cob.Request) -> cob.Page:
     page.add_header("Columns", size=2)
     page.add_pandastable(table.to_dataframe())
 
+    page.add_header("Distributions", size=2)
+    page.add_pandastable(table.distributions_dataframe())
+
     page.add_header("Sample Data", size=2)
-    page.add_pandastable(table.sample)
+    sample = get_sample(dset, table)
+
+    if sample is not None:
+        page.add_pandastable(sample)
+    else:
+        page.add_text("No sample available. Refresh to take one.")
 
     page.add_link("Edit Table Metadata", f"/edit?dataset_name={dset.name}&table_name={table_name}")
     
@@ -248,6 +322,12 @@ def edit(server_request: cob.Request) -> cob.Page:
     dataset_name = server_request.params("dataset_name")
     table_name = server_request.params("table_name")    
 
+    dsets = get_datasets()
+
+    if dsets is None:
+        page.add_alert("Refresh required", "Error", "red")
+        return page
+
     dataset_index = dsets.get_dataset_index(dataset_name)
 
     if dataset_index is None or dataset_index < 0:
@@ -293,11 +373,93 @@ def edit(server_request: cob.Request) -> cob.Page:
 # TODO: You can customize this to your needs
 # This is a sample for SQLite and will need to be updated for your database
 # The rest of the app can stay the same. The only thing that this function needs to do
-# is update the global dsets variable, which is a Datasets object
+# is update the global dsets variable, which is a Datasets object, and save it to the metadata store
 #
 # As an alternative, you can also create the dsets object in a Jupyter Notebook
 # and use app.to_cloud_pickle() to save it to PyCob Cloud.
-# The app uses app.from_cloud_pickle() to load the dsets object from PyCob Cloud.
+# The backup page imports the dsets object from PyCob Cloud into the metadata store.
+def refresh_catalog(job: jobs.Job, mode: str) -> None:
+    """Profiles the source database and replaces the catalog. Runs as a background job."""
+    # Get datasets
+    # Since we're using SQLite, there's no concept of a dataset so we'll create a placeholder one called "northwind"
+    global dsets
+    get_datasets()
+
+    dset = Dataset(name='northwind', readable_name=to_readable_name("northwind"), description='A sample dataset containing customer and order information', tables=[])
+
+    # In incremental mode, tables whose fingerprint hasn't changed are carried over from the previous refresh
+    previous = None
+    previous_tables = {}
+
+    if mode != "Full" and dsets is not None and dsets.get_dataset(dset.name) is not None:
+        previous = dsets.get_dataset(dset.name)
+        previous_tables = {table.name: table for table in previous.tables}
+        dset.readable_name = previous.readable_name
+        dset.description = previous.description
+
+    source_fingerprint = profiler.database_fingerprint(database_path)
+
+    if previous is not None and previous.source_fingerprint == source_fingerprint:
+        job.message = "The database hasn't changed since the last refresh"
+        return
+
+    # Get tables
+    job.message = "Checking which tables changed"
+
+    with closing(db.connect(database_path)) as job_conn:
+        table_names = profiler.get_table_names(job_conn)
+        fingerprints = {}
+
+        for table_name in table_names:
+            job.check_cancelled()
+            fingerprints[table_name] = profiler.fingerprint_table(job_conn, table_name)
+
+    changed = [table_name for table_name in table_names if table_name not in previous_tables or previous_tables[table_name].fingerprint != fingerprints[table_name]]
+    job.total = len(changed)
+    job.message = f"Profiling {len(changed)} of {len(table_names)} tables using {profile_workers} {profile_executor} workers"
+
+    def on_profiled(profile: dict) -> None:
+        job.add_progress({'table_name': profile['name'], 'row_count': profile['row_count'], 'columns': len(profile['columns']), 'seconds': round(profile['elapsed'], 4)})
+
+    # Profile the changed tables in parallel: column stats, row count and sample are computed in a single scan per table
+    try:
+        profiles = profiler.profile_tables(database_path, changed, max_workers=profile_workers, executor=profile_executor, exact_max_rows=profile_exact_max_rows, on_profiled=on_profiled, cancel_event=job.cancel_event) if changed else []
+    except profiler.ProfilingCancelled:
+        raise jobs.JobCancelled()
+
+    profiled = {profile['name']: table_from_profile(profile) for profile in profiles}
+
+    for table_name in table_names:
+        if table_name in profiled:
+            table = profiled[table_name]
+            table.fingerprint = fingerprints[table_name]
+
+            if table_name in previous_tables:
+                merge_metadata(previous_tables[table_name], table)
+        else:
+            table = previous_tables[table_name]
+
+        dset.add_table(table)
+
+    dset.source_fingerprint = source_fingerprint
+
+    with edit_lock:
+        # Nothing is replaced if the job was cancelled before this point
+        job.check_cancelled()
+
+        # Keep the edits saved while the tables were profiled, only the profiled fields come from this refresh
+        if previous is not None:
+            keep_saved_edits(dset)
+
+        refreshed = Datasets(datasets=[])
+        refreshed.add_dataset(dset)
+
+        save_datasets(refreshed)
+        dsets = refreshed
+        search_index.build(dsets)
+
+    job.message = f"Profiled {len(profiles)} of {len(table_names)} tables"
+
 def refresh(server_request: cob.Request) -> cob.Page:
     page = cob.Page("Refresh")
     page.add_header("Refresh")
@@ -308,88 +470,146 @@ def refresh(server_request: cob.Request) -> cob.Page:
         with page.add_card() as card:
             card.add_header("Are You Sure?")
             card.add_text("Refresh the dataset from the source")
-            card.add_alert("This will overwrite any changes you've made to the metadata", "Warning", "yellow")
+            card.add_text("An incremental refresh only re-profiles tables that changed and keeps your metadata edits.")
+            card.add_alert("A full refresh will overwrite any changes you've made to the metadata", "Warning", "yellow")
             with card.add_form() as form:
                 form.add_formhidden("refresh", "true")
+                form.add_formselect("Mode", "mode", options=["Incremental", "Full"], value="Incremental")
                 form.add_formsubmit("Refresh")
         
         return page
-    
-    # Get datasets
-    # Since we're using SQLite, there's no concept of a dataset so we'll create a placeholder one called "northwind"
-    global dsets
-    dsets = Datasets(datasets=[])
 
-    dset = Dataset(name='northwind', readable_name=to_readable_name("northwind"), description='A sample dataset containing customer and order information', tables=[])
-    
-    # Get tables
-    tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table'", conn)
-    # page.add_pandastable(tables)
+    # Only one refresh runs at a time, a second request follows the one already running
+    with refresh_lock:
+        job = refresh_jobs.active("refresh")
 
-    for table_name in tables['name']:
-        # Get table metadata
-        
-        # Get columns
-        columns = pd.read_sql_query(f"PRAGMA table_info('{table_name}')", conn)
-        
-        # Remove the "Picture" or "Photo" column from the sample data
-        columns = columns[columns['name'] != 'Picture']
-        columns = columns[columns['name'] != 'Photo']
+        if job is None:
+            mode = server_request.params("mode")
+            job = refresh_jobs.submit("refresh", lambda job: refresh_catalog(job, mode))
 
-        page.add_pandastable(columns)
-        
-        sample = pd.read_sql_query(f"SELECT * FROM \"{table_name}\" LIMIT 10", conn)
+    page.add_text(f"Refresh job {job.id} started")
+    page.add_link("See progress", f"/refresh_status?job_id={job.id}")
 
-        # Remove the "Picture" column from the sample data if it exists
-        if 'Picture' in sample.columns:
-            sample = sample.drop(columns=['Picture'])
-        if 'Photo' in sample.columns:
-            sample = sample.drop(columns=['Photo'])
+    return page
 
-        row_count = pd.read_sql_query(f"SELECT COUNT(*) as cnt FROM \"{table_name}\"", conn)['cnt'][0]
+def refresh_status(server_request: cob.Request) -> cob.Page:
+    page = cob.Page("Refresh Status")
+    page.add_header("Refresh Status")
 
-        table = Table(name=table_name, readable_name=to_readable_name(table_name), description='', last_updated=datetime.now(), type='', columns=[], sample=sample, row_count=row_count)
+    job = refresh_jobs.get(server_request.params("job_id"))
 
-        # Get column metadata
-        for label, col in columns.iterrows():
-            # Get min, max, mean, num_distinct, num_null, num_rows
-            stats_df = pd.read_sql_query(f"SELECT MIN({col['name']}) as min, MAX({col['name']}) as max, AVG({col['name']}) as mean, COUNT(DISTINCT {col['name']}) as num_distinct, COUNT({col['name']}) as num_rows, COUNT({col['name']} IS NULL) as num_null, COUNT(*) as num_rows FROM \"{table_name}\"", conn)
+    if job is None:
+        page.add_alert("Job not found", "Error", "red")
+        page.add_link("Start a refresh", "/refresh")
+        return page
 
-            try:
-                stats = stats_df.iloc[0].to_dict()
+    if server_request.params("cancel") == "true":
+        job.cancel()
 
-                column = Column(name=col['name'], readable_name=to_readable_name(col['name']), description='', data_type=col['type'], nullable='Nullable' if col['notnull']==0 else 'Not Nullable', min=stats['min'], max=stats['max'], mean=stats['mean'], num_distinct=stats['num_distinct'], num_null=stats['num_null'], num_rows=stats['num_rows'])
-            except:
-                column = Column(name=col['name'], readable_name=to_readable_name(col['name']), description='', data_type=col['type'], nullable='Nullable' if col['notnull']==0 else 'Not Nullable', min=None, max=None, mean=None, num_distinct=None, num_null=None, num_rows=None)
+    if not job.finished:
+        # Reload the page every couple of seconds while the job runs
+        page.add_html('<meta http-equiv="refresh" content="2">')
 
-            table.columns.append(column)
-        
-        dset.tables.append(table)
+    with page.add_card() as card:
+        card.add_text(f"Job {job.id}: {job.status}")
 
-    dsets.datasets.append(dset)
+        if job.message:
+            card.add_text(job.message)
+
+        card.add_text(f"{job.done} of {job.total} tables profiled, {max(0, job.total - job.done)} remaining, {job.elapsed:.1f}s elapsed")
+
+        if job.status == "failed":
+            card.add_alert(job.error, "Error", "red")
+        elif job.status == "cancelled":
+            card.add_alert("The refresh was cancelled, the catalog wasn't changed", "Cancelled", "yellow")
+
+        if not job.finished:
+            with card.add_form() as form:
+                form.add_formhidden("job_id", job.id)
+                form.add_formhidden("cancel", "true")
+                form.add_formsubmit("Cancel")
+
+    if job.progress:
+        page.add_pandastable(pd.DataFrame(list(job.progress)))
+
+    if job.status == "done":
+        page.add_link("Refreshed. See tables", "/tables")
 
-    server_request.app.to_cloud_pickle(dsets, 'northwind.pkl')
-    page.add_link("Refreshed. See tables", "/tables")
-    
     return page
 
 def update(server_request: cob.Request) -> cob.Page:
     page = cob.Page("Update")
     page.add_header("Update")
 
-    update_dataset(server_request.params())
+    # A refresh saving the catalog at the same time would overwrite the edit
+    with edit_lock:
+        update_dataset(server_request.params())
 
     page.add_link("Updated. See tables", "/tables")
 
     return page
 
+def backup(server_request: cob.Request) -> cob.Page:
+    page = cob.Page("Backup")
+    page.add_header("Backup")
+
+    global dsets
+    action = server_request.params("action")
+
+    if action == "Export":
+        dsets = get_datasets()
+
+        if dsets is None:
+            page.add_alert("Refresh required", "Error", "red")
+            return page
+
+        # The export carries the samples, read from the store for the duration of the export
+        for dset in dsets.datasets:
+            for table in dset.tables:
+                table.sample = get_sample(dset, table)
+
+        cloud_pickle.save(dsets)
+
+        if metadata_store.lazy_samples:
+            for dset in dsets.datasets:
+                for table in dset.tables:
+                    table.sample = None
+
+        page.add_alert("Exported the catalog to the cloud pickle", "Success", "green")
+    elif action == "Import":
+        get_datasets()
+
+        try:
+            imported = cloud_pickle.load()
+        except Exception as e:
+            page.add_alert(f"Error getting cloud pickle {e}", "Error", "red")
+            return page
+
+        save_datasets(imported)
+        dsets = imported
+        search_index.build(dsets)
+        page.add_alert("Imported the catalog from the cloud pickle", "Success", "green")
+
+    with page.add_card() as card:
+        card.add_text("Export the catalog to a PyCob cloud pickle, or replace the catalog with the one in the cloud pickle")
+        with card.add_form() as form:
+            form.add_formselect("Action", "action", options=["Export", "Import"], value="Export")
+            form.add_formsubmit("Go")
+
+    page.add_link("See tables", "/tables")
+
+    return page
+
 # APP CONFIGURATION
 
 app.register_function(tables, show_in_navbar=False, footer_category=None)
 app.register_function(refresh, show_in_navbar=True, footer_category=None)
+app.register_function(refresh_status, show_in_navbar=False, footer_category=None)
+app.register_function(search, show_in_navbar=True, footer_category=None)
 app.register_function(edit, show_in_navbar=False, footer_category=None, require_login=True)
 app.register_function(table_detail, show_in_navbar=False, footer_category=None)
 app.register_function(update, show_in_navbar=False, footer_category=None, require_login=True)
+app.register_function(backup, show_in_navbar=False, footer_category=None, require_login=True)
 
 server = app.run()
 # Run this using `python3 main.py` or `python main.py` depending on your system.
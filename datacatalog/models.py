@@ -0,0 +1,233 @@
+# Data model for the Data Catalog
+from __future__ import annotations
+import pandas as pd
+from dataclasses import dataclass
+from datetime import datetime
+from sketches import QUANTILES
+
+class NameIndex:
+    """Maps names to positions in a list of named objects so lookups are O(1) instead of a linear scan.
+    The list stays the source of truth: add items with add_dataset()/add_table() and the index is kept in sync,
+    and if the list is changed directly (appended to or removed from, or the found item renamed) the index rebuilds itself on the next lookup."""
+    def __init__(self, items: list):
+        self.rebuild(items)
+
+    def rebuild(self, items: list) -> None:
+        self.items = items
+        self.size = len(items)
+        self.positions = {item.name: i for i, item in enumerate(items)}
+
+    def add(self, items: list, item) -> None:
+        if items is not self.items or len(items) != self.size:
+            self.rebuild(items)
+
+        self.positions[item.name] = len(self.items)
+        self.items.append(item)
+        self.size = len(self.items)
+
+    def find(self, items: list, name: str) -> int:
+        if items is not self.items or len(items) != self.size:
+            self.rebuild(items)
+
+        i = self.positions.get(name)
+
+        if i is None:
+            return -1
+
+        if items[i].name != name:
+            # An item was replaced in place: rebuild once to be sure
+            self.rebuild(items)
+            i = self.positions.get(name)
+
+        return -1 if i is None else i
+
+# DATA MODEL
+# Python @dataclass is a new feature in Python 3.7 that allows you to define a class with a bunch of attributes and their types.
+# It just makes it easier to define a class with a bunch of attributes without having to define the __init__ method.
+@dataclass
+class Datasets:
+    datasets: list[Dataset]
+
+    def __post_init__(self):
+        self._index = NameIndex(self.datasets)
+        # The catalog listing returned by to_dataframe(), built on first use and patched by update_table_row()
+        self._frame = None
+        self._rows = {}
+
+    # The index and the listing aren't pickled, they are rebuilt when the catalog is loaded
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_index', None)
+        state.pop('_frame', None)
+        state.pop('_rows', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__post_init__()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """One row per table. The frame is cached and patched in place, so don't modify it."""
+        if self._frame is None or len(self._frame) != sum(len(dataset.tables) for dataset in self.datasets):
+            records = [dataset.table_record(table) for dataset in self.datasets for table in dataset.tables]
+
+            self._rows = {(record['dataset_name'], record['table_name']): i for i, record in enumerate(records)}
+            self._frame = pd.DataFrame(records)
+
+        return self._frame
+
+    def update_table_row(self, dataset: Dataset, table: Table) -> None:
+        """Patches the cached listing after the metadata of a table (or its dataset) was edited"""
+        if self._frame is None:
+            return
+
+        row = self._rows.get((dataset.name, table.name))
+
+        if row is None:
+            # The table isn't listed yet, the listing is rebuilt on next use
+            self._frame = None
+            return
+
+        record = dataset.table_record(table)
+
+        # Dataset fields are repeated on every row of the dataset
+        if self._frame.at[row, 'dataset_readable_name'] != record['dataset_readable_name'] or self._frame.at[row, 'dataset_description'] != record['dataset_description']:
+            dataset_rows = self._frame['dataset_name'] == dataset.name
+            self._frame.loc[dataset_rows, 'dataset_readable_name'] = record['dataset_readable_name']
+            self._frame.loc[dataset_rows, 'dataset_description'] = record['dataset_description']
+
+        table_fields = [field for field in record if not field.startswith('dataset_')]
+        self._frame.loc[row, table_fields] = [record[field] for field in table_fields]
+
+    def get_dataset_index(self, dataset_name: str) -> int:
+        return self._index.find(self.datasets, dataset_name)
+
+    def get_dataset(self, dataset_name: str) -> Dataset | None:
+        i = self.get_dataset_index(dataset_name)
+
+        return self.datasets[i] if i >= 0 else None
+
+    def add_dataset(self, dataset: Dataset) -> None:
+        self._index.add(self.datasets, dataset)
+        self._frame = None
+
+@dataclass
+class Dataset:
+    name: str
+    readable_name: str
+    description: str
+    tables: list[Table]
+    # Fingerprint of the source database at the last refresh
+    source_fingerprint: str = ''
+
+    def __post_init__(self):
+        self._index = NameIndex(self.tables)
+
+    # The index isn't pickled, it is rebuilt when the catalog is loaded
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_index', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__post_init__()
+
+    def table_record(self, table: Table) -> dict:
+        row = {}
+        row['dataset_name'] = self.name
+        row['dataset_readable_name'] = self.readable_name
+        row['dataset_description'] = self.description
+        row['table_name'] = table.name
+        row['table_readable_name'] = table.readable_name
+        row['table_description'] = table.description
+        row['row_count'] = table.row_count
+        row['table_last_updated'] = table.last_updated.strftime("%Y-%m-%d %H:%M")
+        row['table_type'] = table.type
+
+        return row
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame([self.table_record(table) for table in self.tables])
+
+    def get_table_index(self, table_name: str) -> int:
+        return self._index.find(self.tables, table_name)
+
+    def get_table(self, table_name: str) -> Table | None:
+        i = self.get_table_index(table_name)
+
+        return self.tables[i] if i >= 0 else None
+
+    def add_table(self, table: Table) -> None:
+        self._index.add(self.tables, table)
+
+@dataclass
+class Table:
+    name: str
+    readable_name: str
+    description: str
+    last_updated: datetime
+    type: str
+    columns: list[Column]
+    sample: pd.DataFrame
+    row_count: int
+    # Fingerprint of the table's schema and size when it was last profiled
+    fingerprint: str = ''
+
+    def to_dataframe(self) -> pd.DataFrame:
+        records = []
+
+        for column in self.columns:
+            row = {}
+            row['column_name'] = column.name
+            row['column_readable_name'] = column.readable_name
+            row['column_description'] = column.description
+            row['column_data_type'] = column.data_type
+            row['column_nullable'] = column.nullable
+            row['column_min'] = column.min
+            row['column_max'] = column.max
+            row['column_mean'] = column.mean
+            # Estimated distinct counts are shown as ~N
+            row['column_num_distinct'] = f"~{column.num_distinct}" if column.distinct_is_estimate else column.num_distinct
+            row['column_num_null'] = column.num_null
+            row['column_num_rows'] = column.num_rows
+            
+            records.append(row)
+        
+        return pd.DataFrame(records)
+
+    def distributions_dataframe(self) -> pd.DataFrame:
+        records = []
+
+        for column in self.columns:
+            row = {}
+            row['column_name'] = column.name
+
+            for q, value in zip(QUANTILES, column.quantiles or [None] * len(QUANTILES)):
+                row[f'p{round(q * 100)}'] = value
+
+            row['most_frequent'] = ", ".join(f"{value} ({count})" for value, count in column.top_values or [])
+
+            records.append(row)
+
+        return pd.DataFrame(records)
+
+@dataclass
+class Column:
+    name: str
+    readable_name: str
+    description: str
+    data_type: str
+    nullable: bool
+    min: float
+    max: float
+    mean: float
+    num_distinct: int
+    num_null: int
+    num_rows: int
+    # True when num_distinct is a HyperLogLog estimate
+    distinct_is_estimate: bool = False
+    # Values at QUANTILES, for columns holding numbers
+    quantiles: list[float] = None
+    # Most frequent values as (value, count)
+    top_values: list[tuple] = None
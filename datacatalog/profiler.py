@@ -0,0 +1,464 @@
+# Column profiling for the Data Catalog.
+# Instead of firing one query per column, MIN/MAX/AVG and null counts of every column come
+# from a single multi-aggregate SELECT. Distinct counts, quantiles and the most frequent
+# values come from one streaming read of the table, a chunk of rows at a time (see
+# sketches.py), which also provides the sample.
+from __future__ import annotations
+import pandas as pd
+import sqlite3 as db
+import sketches
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import quote
+
+# Columns that hold binary data and are left out of the catalog and the sample
+EXCLUDED_COLUMNS = ('Picture', 'Photo')
+
+# SQLite allows at most 2000 result columns per SELECT, and each profiled column
+# uses 4 of them, so very wide tables are profiled in batches of columns.
+MAX_COLUMNS_PER_QUERY = 300
+
+# Tables with at most this many rows get exact distinct counts, quantiles and most frequent values,
+# larger tables get estimates with bounded memory. None means always exact.
+EXACT_MAX_ROWS = 10000
+
+# Rows read at a time by the streaming pass
+CHUNK_SIZE = 50000
+
+# With more than one worker, tables with more rows than this are split into rowid ranges that are
+# profiled as separate parts and merged, so a single large table is spread over the workers
+PART_ROWS = 100000
+
+# Declared types that give a column numeric values, e.g. INTEGER, REAL, DOUBLE, NUMERIC, DECIMAL(10,2).
+# Means and quantiles are only computed for these. Dates are left out, SQLite apps usually store them as text.
+NUMERIC_TYPE = re.compile(r"INT|REAL|FLOA|DOUB|NUM|DEC|BOOL", re.IGNORECASE)
+
+class ProfilingCancelled(Exception):
+    pass
+
+def is_interrupted(e: db.Error) -> bool:
+    # Raised in a query stopped by Connection.interrupt()
+    return str(e) == "interrupted"
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def get_table_names(conn: db.Connection) -> list[str]:
+    tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table'", conn)
+
+    return list(tables['name'])
+
+def get_columns(conn: db.Connection, table_name: str) -> pd.DataFrame:
+    columns = pd.read_sql_query(f"PRAGMA table_info({quote_identifier(table_name)})", conn)
+
+    # Remove the "Picture" or "Photo" column
+    columns = columns[~columns['name'].isin(EXCLUDED_COLUMNS)]
+
+    return columns.reset_index(drop=True)
+
+def get_sample(conn: db.Connection, table_name: str, sample_size: int = 10) -> pd.DataFrame:
+    sample = pd.read_sql_query(f"SELECT * FROM {quote_identifier(table_name)} LIMIT {int(sample_size)}", conn)
+
+    return sample.drop(columns=[c for c in EXCLUDED_COLUMNS if c in sample.columns])
+
+def rowid_filter(rowids: tuple[int, int] | None) -> str:
+    """WHERE clause for the rows with a rowid in [start, end), none for the whole table"""
+    return "" if rowids is None else f" WHERE rowid >= {int(rowids[0])} AND rowid < {int(rowids[1])}"
+
+def _stats_query(table_name: str, column_names: list[str], averaged: set, rowids: tuple[int, int] | None = None) -> str:
+    aggregates = ["COUNT(*)"]
+
+    for name in column_names:
+        col = quote_identifier(name)
+        aggregates.extend([f"MIN({col})", f"MAX({col})", f"AVG({col})" if name in averaged else "NULL", f"COUNT({col})"])
+
+    return f"SELECT {', '.join(aggregates)} FROM {quote_identifier(table_name)}{rowid_filter(rowids)}"
+
+def profile_columns(conn: db.Connection, table_name: str, column_names: list[str], averaged: list[str] | None = None, rowids: tuple[int, int] | None = None) -> tuple[int, dict]:
+    """Returns the row count and a dict of column name -> stats, scanning the table (or the rowids range) once per batch of columns.
+    The mean is only computed for the averaged columns, all of them by default."""
+    averaged = set(column_names if averaged is None else averaged)
+    row_count = 0
+    stats = {}
+
+    # A table with no profiled columns still needs its row count
+    batches = [column_names[i:i + MAX_COLUMNS_PER_QUERY] for i in range(0, len(column_names), MAX_COLUMNS_PER_QUERY)] or [[]]
+
+    for batch in batches:
+        row = conn.execute(_stats_query(table_name, batch, averaged, rowids)).fetchone()
+        row_count = row[0]
+
+        for i, name in enumerate(batch):
+            min_, max_, mean, num_non_null = row[1 + i * 4:5 + i * 4]
+            stats[name] = {
+                'min': min_,
+                'max': max_,
+                'mean': mean,
+                'num_null': row_count - num_non_null,
+                'num_rows': row_count,
+            }
+
+    return row_count, stats
+
+def is_numeric_type(declared_type: str) -> bool:
+    return bool(NUMERIC_TYPE.search(declared_type or ""))
+
+def stream_columns(conn: db.Connection, table_name: str, columns: pd.DataFrame, sample_size: int = 10, exact_max_rows: int | None = EXACT_MAX_ROWS, rowids: tuple[int, int] | None = None) -> tuple[pd.DataFrame, dict]:
+    """Reads the table (or the rowids range) once, a chunk at a time, and returns the first rows as a sample and a dict of column name -> ColumnStats"""
+    column_names = list(columns['name'])
+    column_stats = {name: sketches.ColumnStats(exact_max_rows, is_numeric_type(declared_type), 'INT' in (declared_type or '').upper()) for name, declared_type in zip(column_names, columns['type'])}
+    sample_rows = None
+
+    cursor = conn.execute(f"SELECT {', '.join(quote_identifier(name) for name in column_names)} FROM {quote_identifier(table_name)}{rowid_filter(rowids)}")
+
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+
+        if not rows:
+            break
+
+        if sample_rows is None:
+            sample_rows = rows[:sample_size]
+
+        # Much faster than transposing the chunk with zip(*rows)
+        for i, stats in enumerate(column_stats.values()):
+            stats.update(list(map(itemgetter(i), rows)))
+
+    sample = pd.DataFrame.from_records(sample_rows or [], columns=column_names, coerce_float=True)
+
+    return sample, column_stats
+
+def profile_table(conn: db.Connection, table_name: str, sample_size: int = 10, exact_max_rows: int | None = EXACT_MAX_ROWS) -> dict:
+    """Profiles a table: its columns (from PRAGMA table_info), the column stats, the row count and a sample"""
+    return finish_profile(profile_part(conn, table_name, None, sample_size, exact_max_rows))
+
+def profile_part(conn: db.Connection, table_name: str, rowids: tuple[int, int] | None = None, sample_size: int = 10, exact_max_rows: int | None = EXACT_MAX_ROWS) -> dict:
+    """Profiles the rows of a table with a rowid in [start, end), or the whole table for rowids=None.
+    The parts of a table are combined with merge_parts(), and finish_profile() turns them into the table's profile."""
+    columns = get_columns(conn, table_name)
+    column_names = list(columns['name'])
+    # AVG of text is meaningless, and costs as much as converting every value to a number
+    averaged = [name for name, declared_type in zip(column_names, columns['type']) if is_numeric_type(declared_type)]
+    row_count, stats = aggregate_columns(conn, table_name, column_names, averaged, rowids)
+    column_stats = None
+
+    if not column_names:
+        sample = get_sample(conn, table_name, sample_size)
+    else:
+        try:
+            sample, column_stats = stream_columns(conn, table_name, columns, sample_size, exact_max_rows, rowids)
+        except db.Error as e:
+            if is_interrupted(e):
+                raise
+
+            print(f"Error streaming {table_name}, distinct counts and distributions are unavailable: {e}")
+            sample = get_sample(conn, table_name, sample_size)
+
+    return {
+        'name': table_name,
+        'rowids': rowids,
+        'columns': columns,
+        'stats': stats,
+        'column_stats': column_stats,
+        'row_count': row_count,
+        'sample': sample,
+    }
+
+def finish_profile(profile: dict) -> dict:
+    """Adds the distinct counts, quantiles and most frequent values of the streamed columns to their stats"""
+    column_stats = profile.pop('column_stats')
+    profile.pop('rowids')
+
+    for name, column in (column_stats or {}).items():
+        if profile['stats'][name] is not None:
+            profile['stats'][name].update({
+                'num_distinct': column.num_distinct(),
+                'distinct_is_estimate': not column.is_exact,
+                'quantiles': column.quantiles(),
+                'top_values': column.top(),
+            })
+
+    return profile
+
+def aggregate_columns(conn: db.Connection, table_name: str, column_names: list[str], averaged: list[str] | None = None, rowids: tuple[int, int] | None = None) -> tuple[int, dict]:
+    """MIN/MAX/AVG and null counts from the multi-aggregate SELECT, falling back to one query per column so a single bad column doesn't lose the whole table"""
+    try:
+        return profile_columns(conn, table_name, column_names, averaged, rowids)
+    except db.Error as e:
+        if is_interrupted(e):
+            raise
+
+        print(f"Error profiling {table_name} in one pass, profiling column by column: {e}")
+        row_count = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table_name)}{rowid_filter(rowids)}").fetchone()[0]
+        stats = {}
+
+        for name in column_names:
+            try:
+                stats.update(profile_columns(conn, table_name, [name], averaged, rowids)[1])
+            except db.Error:
+                stats[name] = None
+
+        return row_count, stats
+
+# SPLITTING LARGE TABLES
+# A large table is profiled as rowid ranges, each in its own query on any worker. Each part
+# is read in its own transaction, so with concurrent writes the parts can see different versions.
+
+def split_table(conn: db.Connection, table_name: str, part_rows: int = PART_ROWS) -> list[tuple[int, int] | None]:
+    """Rowid ranges [start, end) of about part_rows rows that cover the table, or [None] to profile it in one part.
+    Uses the lowest and highest rowid, so a table with gaps in its rowids gets smaller parts."""
+    columns = pd.read_sql_query(f"PRAGMA table_info({quote_identifier(table_name)})", conn)
+
+    # A column named rowid hides the real one
+    if columns['name'].str.lower().eq('rowid').any():
+        return [None]
+
+    try:
+        start, end = conn.execute(f"SELECT MIN(rowid), MAX(rowid) + 1 FROM {quote_identifier(table_name)}").fetchone()
+    except db.OperationalError:
+        # WITHOUT ROWID tables
+        return [None]
+
+    if start is None or end - start <= part_rows:
+        return [None]
+
+    num_parts = -(-(end - start) // part_rows)
+    bounds = [start + (end - start) * i // num_parts for i in range(num_parts + 1)]
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def sqlite_order(value) -> tuple:
+    """Sort key that orders values of different types like SQLite does: numbers, then text, then blobs"""
+    if isinstance(value, (int, float)):
+        return (0, value)
+
+    return (1, value) if isinstance(value, str) else (2, value)
+
+def merge_stats(parts: list[dict]) -> dict:
+    """The MIN/MAX/AVG and null counts of a column over all the parts"""
+    non_null = [part['num_rows'] - part['num_null'] for part in parts]
+    mins = [part['min'] for part in parts if part['min'] is not None]
+    maxes = [part['max'] for part in parts if part['max'] is not None]
+    means = [(part['mean'], n) for part, n in zip(parts, non_null) if part['mean'] is not None]
+
+    return {
+        'min': min(mins, key=sqlite_order) if mins else None,
+        'max': max(maxes, key=sqlite_order) if maxes else None,
+        'mean': sum(mean * n for mean, n in means) / sum(n for _, n in means) if means else None,
+        'num_null': sum(part['num_null'] for part in parts),
+        'num_rows': sum(part['num_rows'] for part in parts),
+    }
+
+def merge_parts(parts: list[dict]) -> dict:
+    """Combines the profiles of the parts of a table, in any order, into one as if the table had been profiled at once"""
+    if len(parts) == 1:
+        return parts[0]
+
+    parts = sorted(parts, key=lambda part: part['rowids'][0])
+    first = parts[0]
+    stats = {}
+    column_stats = None
+
+    for name in first['stats']:
+        column_parts = [part['stats'][name] for part in parts]
+        stats[name] = None if any(column is None for column in column_parts) else merge_stats(column_parts)
+
+    if all(part['column_stats'] is not None for part in parts):
+        column_stats = first['column_stats']
+
+        for part in parts[1:]:
+            for name, column in column_stats.items():
+                column.merge(part['column_stats'][name])
+
+    sample_size = max(len(part['sample']) for part in parts)
+
+    return {
+        'name': first['name'],
+        'rowids': (first['rowids'][0], parts[-1]['rowids'][1]),
+        'columns': first['columns'],
+        'stats': stats,
+        'column_stats': column_stats,
+        'row_count': sum(part['row_count'] for part in parts),
+        'sample': pd.concat([part['sample'] for part in parts], ignore_index=True).head(sample_size),
+        # Time spent on the table by all the workers together
+        'elapsed': sum(part['elapsed'] for part in parts),
+    }
+
+# PARALLEL PROFILING
+# Tables are profiled concurrently, each worker using its own read-only connection.
+# Large tables are split into parts first (see split_table), which are profiled like tables.
+# The sqlite3 module only releases the GIL inside SQLite, and most of the time goes to turning rows
+# into Python objects and sketches, which holds it. So tables are profiled in a process pool by default,
+# a thread pool doesn't scale with cores.
+
+def connect_read_only(path: str, immutable: bool = False) -> db.Connection:
+    """Opens a read-only connection. Only use immutable=True if nothing writes to the database while the app runs."""
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+    if immutable:
+        uri += "&immutable=1"
+
+    return db.connect(uri, uri=True, check_same_thread=False)
+
+class ConnectionPool:
+    """A bounded pool of read-only connections to one database"""
+    def __init__(self, path: str, size: int, immutable: bool = False, exact_max_rows: int | None = EXACT_MAX_ROWS):
+        self.exact_max_rows = exact_max_rows
+        self.connections = queue.Queue(maxsize=size)
+        self.in_use = set()
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+        for _ in range(size):
+            self.connections.put(connect_read_only(path, immutable))
+
+    def profile_part(self, table_name: str, rowids: tuple[int, int] | None) -> dict:
+        if self.cancelled.is_set():
+            raise ProfilingCancelled()
+
+        conn = self.connections.get()
+
+        with self.lock:
+            self.in_use.add(conn)
+
+        try:
+            return timed_profile_part(conn, table_name, rowids, self.exact_max_rows)
+        finally:
+            with self.lock:
+                self.in_use.discard(conn)
+
+            self.connections.put(conn)
+
+    def interrupt(self) -> None:
+        """Stops the queries that are running and any table that hasn't started yet"""
+        self.cancelled.set()
+
+        with self.lock:
+            for conn in self.in_use:
+                conn.interrupt()
+
+    def close(self) -> None:
+        while not self.connections.empty():
+            self.connections.get().close()
+
+def timed_profile_part(conn: db.Connection, table_name: str, rowids: tuple[int, int] | None, exact_max_rows: int | None = EXACT_MAX_ROWS) -> dict:
+    start = time.perf_counter()
+    profile = profile_part(conn, table_name, rowids, exact_max_rows=exact_max_rows)
+    profile['elapsed'] = time.perf_counter() - start
+
+    return profile
+
+# Each worker process keeps a single connection for its lifetime
+_process_conn = None
+_process_exact_max_rows = EXACT_MAX_ROWS
+
+def _init_process(path: str, immutable: bool, exact_max_rows: int | None) -> None:
+    global _process_conn, _process_exact_max_rows
+    _process_conn = connect_read_only(path, immutable)
+    _process_exact_max_rows = exact_max_rows
+
+def _profile_part_in_process(table_name: str, rowids: tuple[int, int] | None) -> dict:
+    return timed_profile_part(_process_conn, table_name, rowids, _process_exact_max_rows)
+
+def _split_tables(path: str, table_names: list[str], immutable: bool, split: bool) -> list[tuple[str, tuple[int, int] | None]]:
+    """The (table name, rowids) parts to profile, one per table unless split"""
+    if not split:
+        return [(table_name, None) for table_name in table_names]
+
+    with closing(connect_read_only(path, immutable)) as conn:
+        return [(table_name, rowids) for table_name in table_names for rowids in split_table(conn, table_name)]
+
+def _collect(futures: list, num_parts: dict, on_profiled, cancel_event: threading.Event | None, on_cancel) -> dict:
+    """Waits for the parts, reporting each table as its last part finishes and checking for cancellation in between"""
+    profiles = {}
+    parts = {table_name: [] for table_name in num_parts}
+    pending = set(futures)
+
+    while pending:
+        done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            part = future.result()
+            parts[part['name']].append(part)
+
+            if len(parts[part['name']]) < num_parts[part['name']]:
+                continue
+
+            profile = finish_profile(merge_parts(parts.pop(part['name'])))
+            profiles[profile['name']] = profile
+
+            if on_profiled is not None:
+                on_profiled(profile)
+
+        if cancel_event is not None and cancel_event.is_set():
+            for future in pending:
+                future.cancel()
+
+            on_cancel()
+            raise ProfilingCancelled()
+
+    return profiles
+
+def profile_tables(path: str, table_names: list[str], max_workers: int = None, executor: str = "process", immutable: bool = False, exact_max_rows: int | None = EXACT_MAX_ROWS, on_profiled=None, cancel_event: threading.Event | None = None) -> list[dict]:
+    """Profiles the tables concurrently and returns the profiles in the same order as table_names.
+    on_profiled(profile) is called as each table finishes. Setting cancel_event stops profiling and raises ProfilingCancelled."""
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor {executor}, expected 'thread' or 'process'")
+
+    max_workers = max_workers or os.cpu_count() or 1
+    parts = _split_tables(path, table_names, immutable, split=max_workers > 1)
+    num_parts = Counter(table_name for table_name, _ in parts)
+    max_workers = max(1, min(max_workers, len(parts)))
+
+    if executor == "process":
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_process, initargs=(path, immutable, exact_max_rows)) as pool:
+            # Parts already being profiled in a worker process run to completion
+            profiles = _collect([pool.submit(_profile_part_in_process, table_name, rowids) for table_name, rowids in parts], num_parts, on_profiled, cancel_event, lambda: None)
+
+        return [profiles[table_name] for table_name in table_names]
+
+    pool = ConnectionPool(path, max_workers, immutable, exact_max_rows)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as workers:
+            profiles = _collect([workers.submit(pool.profile_part, table_name, rowids) for table_name, rowids in parts], num_parts, on_profiled, cancel_event, pool.interrupt)
+    finally:
+        pool.close()
+
+    return [profiles[table_name] for table_name in table_names]
+
+# CHANGE DETECTION
+# Fingerprints let refresh skip tables that haven't changed since they were last profiled.
+
+def database_fingerprint(path: str) -> str:
+    """Changes whenever anything is written to the database file (or its WAL file)"""
+    parts = []
+
+    for file in (path, path + "-wal"):
+        if os.path.exists(file):
+            stat = os.stat(file)
+            parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+
+    return "|".join(parts)
+
+def fingerprint_table(conn: db.Connection, table_name: str) -> str:
+    """Hash of the table schema, row count and highest rowid.
+    This is cheap compared to profiling, but an UPDATE that leaves the row count and rowids alone isn't detected,
+    so run a full refresh after bulk updates."""
+    schema = conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()
+
+    try:
+        size = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {quote_identifier(table_name)}").fetchone()
+    except db.OperationalError:
+        # WITHOUT ROWID tables
+        size = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table_name)}").fetchone()
+
+    return hashlib.sha1(repr((schema, size)).encode()).hexdigest()
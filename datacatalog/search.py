@@ -0,0 +1,172 @@
+# Full-text search over the catalog metadata.
+# An in-process inverted index over the names, readable names and descriptions of datasets,
+# tables and columns. It works with any metadata store, and is updated a table at a time
+# when metadata is edited.
+from __future__ import annotations
+import bisect
+import heapq
+import re
+import threading
+from models import Datasets, Dataset, Table
+
+# Matches in names rank above matches in readable names, which rank above matches in descriptions
+FIELD_WEIGHTS = {'name': 3, 'readable_name': 2, 'description': 1}
+
+def tokenize(text: str | None) -> list[str]:
+    if not text:
+        return []
+
+    # Split camelCase so "CategoryName" matches "category" and "name"
+    text = re.sub(r'(?<=[a-z0-9])(?=[A-Z])', ' ', text)
+
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            # token -> {doc_id: score}
+            self.postings = {}
+            # Sorted tokens, for prefix matches
+            self.vocabulary = []
+            self.docs = {}
+            self.doc_tokens = {}
+            # (dataset_name, table_name) -> doc ids of the table and its columns, table_name None for the dataset itself
+            self.doc_ids = {}
+            self.next_doc_id = 0
+
+    def build(self, dsets: Datasets | None) -> None:
+        with self.lock:
+            self.clear()
+
+            if dsets is None:
+                return
+
+            for dataset in dsets.datasets:
+                self._add_dataset(dataset)
+
+                for table in dataset.tables:
+                    self._add_table(dataset, table)
+
+            self.vocabulary = sorted(self.postings)
+
+    def update_table(self, dataset: Dataset, table: Table) -> None:
+        """Re-indexes a table, its columns and its dataset after their metadata was edited"""
+        with self.lock:
+            before = set()
+
+            for key in [(dataset.name, None), (dataset.name, table.name)]:
+                for doc_id in self.doc_ids.pop(key, []):
+                    before |= self._remove(doc_id)
+
+            after = set()
+            after |= self._add_dataset(dataset)
+            after |= self._add_table(dataset, table)
+
+            # Keep the vocabulary sorted without re-sorting all of it
+            for token in before - after:
+                if token not in self.postings:
+                    self.vocabulary.pop(bisect.bisect_left(self.vocabulary, token))
+
+            for token in after - before:
+                i = bisect.bisect_left(self.vocabulary, token)
+
+                if i == len(self.vocabulary) or self.vocabulary[i] != token:
+                    self.vocabulary.insert(i, token)
+
+    def search(self, query: str, limit: int = 50) -> list[dict]:
+        """Returns the best matches for all the words in the query. The last word also matches as a prefix, for search as you type."""
+        tokens = tokenize(query)
+
+        if not tokens:
+            return []
+
+        with self.lock:
+            scores = None
+
+            for i, token in enumerate(tokens):
+                matches = self._prefix_matches(token) if i == len(tokens) - 1 else self.postings.get(token, {})
+
+                if scores is None:
+                    scores = dict(matches)
+                else:
+                    scores = {doc_id: score + matches[doc_id] for doc_id, score in scores.items() if doc_id in matches}
+
+                if not scores:
+                    return []
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+            return [dict(self.docs[doc_id], score=score) for doc_id, score in best]
+
+    def _prefix_matches(self, prefix: str) -> dict:
+        matches = {}
+        i = bisect.bisect_left(self.vocabulary, prefix)
+
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            token = self.vocabulary[i]
+
+            for doc_id, score in self.postings[token].items():
+                # Exact matches rank above prefix matches
+                score = score if token == prefix else score / 2
+                matches[doc_id] = max(matches.get(doc_id, 0), score)
+
+            i += 1
+
+        return matches
+
+    def _add_dataset(self, dataset: Dataset) -> set:
+        return self._add((dataset.name, None), {'kind': 'dataset', 'dataset_name': dataset.name, 'table_name': '', 'column_name': ''}, dataset.name, dataset.readable_name, dataset.description)
+
+    def _add_table(self, dataset: Dataset, table: Table) -> set:
+        doc = {'kind': 'table', 'dataset_name': dataset.name, 'table_name': table.name, 'column_name': ''}
+        tokens = set(self._add((dataset.name, table.name), doc, table.name, table.readable_name, table.description))
+
+        for column in table.columns:
+            doc = {'kind': 'column', 'dataset_name': dataset.name, 'table_name': table.name, 'column_name': column.name}
+            tokens |= self._add((dataset.name, table.name), doc, column.name, column.readable_name, column.description)
+
+        return tokens
+
+    def _add(self, key: tuple, doc: dict, name: str, readable_name: str, description: str) -> set:
+        doc_id = self.next_doc_id
+        self.next_doc_id += 1
+
+        self.docs[doc_id] = dict(doc, readable_name=readable_name, description=description)
+        self.doc_ids.setdefault(key, []).append(doc_id)
+
+        fields = {'name': name, 'readable_name': readable_name, 'description': description}
+        doc_tokens = set()
+
+        for field, text in fields.items():
+            tokens = tokenize(text)
+
+            # Identifiers also match as a whole, e.g. "customerid"
+            if field == 'name' and len(tokens) > 1:
+                tokens.append(''.join(tokens))
+
+            for token in tokens:
+                postings = self.postings.setdefault(token, {})
+                postings[doc_id] = postings.get(doc_id, 0) + FIELD_WEIGHTS[field]
+
+            doc_tokens.update(tokens)
+
+        self.doc_tokens[doc_id] = doc_tokens
+
+        return doc_tokens
+
+    def _remove(self, doc_id: int) -> set:
+        del self.docs[doc_id]
+        tokens = self.doc_tokens.pop(doc_id)
+
+        for token in tokens:
+            postings = self.postings[token]
+            del postings[doc_id]
+
+            if not postings:
+                del self.postings[token]
+
+        return tokens
@@ -0,0 +1,318 @@
+# Streaming column statistics for the Data Catalog.
+# The sketches are updated one chunk of rows at a time with bounded memory, so a table
+# of any size can be profiled in a single pass:
+# - HyperLogLog for approximate distinct counts
+# - a KLL sketch for quantiles
+# - Misra-Gries for the most frequent values
+# All three can be merged, so parts of a table profiled separately add up to the whole table.
+# For small tables ColumnStats also keeps exact value counts, and uses them instead.
+# Each chunk is reduced to its value counts by pandas first, so the sketches only see distinct values.
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+TOP_K = 5
+
+def hash_numbers(numbers: np.ndarray) -> np.ndarray:
+    """64-bit hashes of numbers, equal for equal values whether they were stored as integers or reals (1 == 1.0, like SQLite)"""
+    return pd.util.hash_array(numbers.astype(np.float64))
+
+def hash_keys(keys: pd.Index) -> np.ndarray:
+    """64-bit hashes of distinct values, numbers hashed as numbers and anything else by its text"""
+    if keys.dtype.kind in 'iuf':
+        return hash_numbers(keys.to_numpy())
+
+    values = keys.to_numpy(dtype=object)
+
+    if keys.inferred_type == 'string':
+        return pd.util.hash_array(values)
+
+    is_number = number_mask(keys)
+    others = np.array([value if isinstance(value, (str, bytes)) else str(value) for value in values[~is_number]], dtype=object)
+
+    return np.concatenate([hash_numbers(values[is_number].astype(np.float64)), pd.util.hash_array(others)])
+
+def number_mask(keys: pd.Index) -> np.ndarray:
+    """Which of the distinct values are numbers"""
+    if keys.dtype.kind in 'iuf':
+        return np.ones(len(keys), dtype=bool)
+
+    if keys.inferred_type == 'string':
+        return np.zeros(len(keys), dtype=bool)
+
+    return np.fromiter((isinstance(key, (int, float)) for key in keys), dtype=bool, count=len(keys))
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, qs: tuple) -> list[float]:
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    positions = np.searchsorted(cumulative, np.array(qs) * cumulative[-1], side='left')
+
+    return [float(x) for x in values[order][np.minimum(positions, len(values) - 1)]]
+
+class HyperLogLog:
+    def __init__(self, p: int = 14):
+        # 2^p registers, standard error about 1.04 / sqrt(2^p), 0.8% for p=14
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray) -> None:
+        if len(hashes) == 0:
+            return
+
+        # The top p bits pick the register, the rank is the position of the leftmost 1 in the lower 50 bits.
+        # 50 bits fit exactly in a float64, so frexp gives their exact bit length.
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        w = (hashes & np.uint64((1 << 50) - 1)).astype(np.float64)
+        rank = (51 - np.frexp(w)[1]).astype(np.uint8)
+
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: HyperLogLog) -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+
+        # Small range correction
+        zeros = np.count_nonzero(self.registers == 0)
+
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+
+        return int(round(estimate))
+
+class KLLSketch:
+    def __init__(self, k: int = 200, seed: int = 0):
+        # Rank error is roughly 1.7 / k
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values: np.ndarray) -> None:
+        if len(values) == 0:
+            return
+
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+
+    def merge(self, other: KLLSketch) -> None:
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+
+            self.levels[level] = np.concatenate([self.levels[level], items])
+
+        self.compress()
+
+    def compress(self) -> None:
+        level = 0
+
+        while level < len(self.levels):
+            items = self.levels[level]
+
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                # Keep every other sorted item (at a random offset) with twice the weight
+                items = np.sort(items)
+                keep_odd = len(items) % 2
+                pairs = items[keep_odd:]
+                promoted = pairs[self.rng.integers(2)::2]
+
+                self.levels[level] = items[:keep_odd]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+            level += 1
+
+    def quantiles(self, qs: tuple = QUANTILES) -> list[float] | None:
+        items = np.concatenate(self.levels)
+
+        if len(items) == 0:
+            return None
+
+        weights = np.concatenate([np.full(len(level_items), 2 ** level, dtype=np.float64) for level, level_items in enumerate(self.levels)])
+
+        return weighted_quantiles(items, weights, qs)
+
+class FrequentItems:
+    """Misra-Gries summary: any value more frequent than 1/capacity of the rows is kept, with a count that is a lower bound"""
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+
+    def summarize(self, value_counts: pd.Series) -> pd.Series:
+        """The summary of one chunk's value counts: the capacity largest, less the next largest count.
+        Summaries can be merged (Agarwal et al., Mergeable Summaries), so only these are added to the running one."""
+        if len(value_counts) <= self.capacity:
+            return value_counts
+
+        counts = value_counts.to_numpy()
+        largest = np.argpartition(counts, -(self.capacity + 1))[-(self.capacity + 1):]
+        threshold = counts[largest].min()
+        largest = largest[counts[largest] > threshold]
+
+        return value_counts.iloc[largest] - threshold
+
+    def update(self, value_counts: pd.Series) -> None:
+        counts = self.counts.add(self.summarize(value_counts), fill_value=0).astype(np.int64)
+
+        if len(counts) > self.capacity:
+            # Decrement everything by the (capacity + 1)-th largest count and drop what reaches zero
+            counts = counts.sort_values(ascending=False)
+            counts = counts - counts.iloc[self.capacity]
+            counts = counts[counts > 0]
+
+        self.counts = counts
+
+    def merge(self, other: FrequentItems) -> None:
+        self.update(other.counts)
+
+class ColumnStats:
+    """Distinct count, quantiles and most frequent values of one column, updated a chunk at a time.
+    Exact value counts are kept until the column has seen more than exact_max_rows values (None for no limit),
+    then they seed the sketches and only the sketches are updated from there on.
+    Quantiles are only computed for columns with a numeric declared type."""
+    def __init__(self, exact_max_rows: int | None, numeric: bool = True, integer: bool = False):
+        self.exact_max_rows = exact_max_rows
+        self.numeric = numeric
+        # Declared INTEGER, so values counted as floats are turned back into ints
+        self.integer = integer
+        self.rows = 0
+        # Value counts of each chunk so far, combined when asked for, None once the column switched to the sketches
+        self.chunk_counts = []
+        self.hll = None
+        self.kll = None
+        self.frequent = None
+
+    def update(self, values: list) -> None:
+        """Adds a chunk of the column's values as read from the cursor, None for NULL"""
+        value_counts = self.value_counts(values)
+
+        if len(value_counts) == 0:
+            return
+
+        self.rows += int(value_counts.sum())
+
+        if self.chunk_counts is not None:
+            self.chunk_counts.append(value_counts)
+
+            if self.exact_max_rows is not None and self.rows > self.exact_max_rows:
+                # Too many rows to count exactly
+                self.start_sketches()
+
+            return
+
+        self.update_sketches(value_counts)
+
+    def merge(self, other: ColumnStats) -> None:
+        """Adds the values counted by another ColumnStats of the same column, e.g. for another range of rows"""
+        self.rows += other.rows
+
+        if self.is_exact and other.is_exact:
+            self.chunk_counts.extend(other.chunk_counts)
+
+            if self.exact_max_rows is not None and self.rows > self.exact_max_rows:
+                self.start_sketches()
+
+            return
+
+        if self.is_exact:
+            self.start_sketches()
+
+        if other.is_exact:
+            self.update_sketches(other.exact_counts)
+        else:
+            self.hll.merge(other.hll)
+            self.kll.merge(other.kll)
+            self.frequent.merge(other.frequent)
+
+    def start_sketches(self) -> None:
+        """Switches to the sketches, starting from what was counted so far"""
+        exact_counts = self.exact_counts
+        self.hll = HyperLogLog()
+        self.kll = KLLSketch()
+        self.frequent = FrequentItems()
+        self.chunk_counts = None
+        self.update_sketches(exact_counts)
+
+    @property
+    def exact_counts(self) -> pd.Series:
+        """value -> count over every chunk so far"""
+        if len(self.chunk_counts) > 1:
+            self.chunk_counts = [pd.concat(self.chunk_counts).groupby(level=0, sort=False).sum()]
+
+        return self.chunk_counts[0] if self.chunk_counts else pd.Series(dtype=np.int64)
+
+    def value_counts(self, values: list) -> pd.Series:
+        """Counts of the chunk's distinct values, without NULLs. Numeric columns are counted from a NumPy array when they can be."""
+        if self.numeric:
+            # NULLs become NaN. Text left in a numeric column can't be numeric looking, SQLite would have stored it as a number.
+            try:
+                array = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                array = None
+
+            if array is not None:
+                keys, counts = np.unique(array[~np.isnan(array)], return_counts=True)
+
+                # Integers are read back as floats
+                if self.integer and len(keys) and np.array_equal(keys, np.floor(keys)) and max(-keys[0], keys[-1]) < 2 ** 53:
+                    keys = keys.astype(np.int64)
+
+                return pd.Series(counts, index=keys)
+
+        codes, keys = pd.factorize(np.array(values, dtype=object))
+
+        return pd.Series(np.bincount(codes[codes >= 0], minlength=len(keys)), index=pd.Index(keys, dtype=object))
+
+    def update_sketches(self, value_counts: pd.Series) -> None:
+        self.frequent.update(value_counts)
+        self.hll.update(hash_keys(value_counts.index))
+
+        if self.numeric:
+            numbers, counts = self.numbers(value_counts)
+            self.kll.update(np.repeat(numbers, counts))
+
+    def numbers(self, value_counts: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """The distinct values that are numbers, as floats, and their counts"""
+        is_number = number_mask(value_counts.index)
+
+        return value_counts.index.to_numpy()[is_number].astype(np.float64), value_counts.to_numpy(dtype=np.int64)[is_number]
+
+    @property
+    def is_exact(self) -> bool:
+        return self.chunk_counts is not None
+
+    def num_distinct(self) -> int:
+        return len(self.exact_counts) if self.is_exact else self.hll.count()
+
+    def quantiles(self, qs: tuple = QUANTILES) -> list[float] | None:
+        if not self.numeric:
+            return None
+
+        if not self.is_exact:
+            return self.kll.quantiles(qs)
+
+        numbers, weights = self.numbers(self.exact_counts)
+
+        if len(numbers) == 0:
+            return None
+
+        return weighted_quantiles(numbers, weights.astype(np.float64), qs)
+
+    def top(self, k: int = TOP_K) -> list[tuple]:
+        counts = self.exact_counts if self.is_exact else self.frequent.counts
+        largest = np.argsort(-counts.to_numpy(), kind='stable')[:k]
+
+        return [(to_python(value), int(count)) for value, count in counts.iloc[largest].items()]
+
+def to_python(value):
+    return value.item() if hasattr(value, 'item') else value
@@ -0,0 +1,196 @@
+# Metadata stores for the Data Catalog.
+# A store loads and saves the catalog. SQLiteStore keeps datasets, tables and columns
+# as rows, so saving an edit only touches the rows of the edited table. It keeps table
+# samples apart from the metadata, so they are only read when a table is viewed.
+# CloudPickleStore keeps the whole catalog in a PyCob cloud pickle, which is also
+# used to export and import the catalog.
+from __future__ import annotations
+import abc
+import json
+import pandas as pd
+import pickle
+import sqlite3 as db
+from contextlib import closing
+from datetime import datetime
+from models import Datasets, Dataset, Table, Column
+
+class MetadataStore(abc.ABC):
+    # True if load() leaves Table.sample empty and samples are read with load_sample()
+    lazy_samples = False
+
+    @abc.abstractmethod
+    def load(self) -> Datasets | None:
+        """Returns the saved catalog, or None if nothing has been saved yet"""
+
+    @abc.abstractmethod
+    def save(self, dsets: Datasets) -> None:
+        """Replaces the saved catalog"""
+
+    @abc.abstractmethod
+    def save_table(self, dsets: Datasets, dataset: Dataset, table: Table) -> None:
+        """Saves the metadata of one table, its columns and its dataset after an edit"""
+
+    def load_sample(self, dataset_name: str, table_name: str) -> pd.DataFrame | None:
+        return None
+
+class CloudPickleStore(MetadataStore):
+    def __init__(self, app, name: str):
+        self.app = app
+        self.name = name
+
+    def load(self) -> Datasets | None:
+        return self.app.from_cloud_pickle(self.name)
+
+    def save(self, dsets: Datasets) -> None:
+        self.app.to_cloud_pickle(dsets, self.name)
+
+    def save_table(self, dsets: Datasets, dataset: Dataset, table: Table) -> None:
+        # A pickle can only be written as a whole
+        self.save(dsets)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_datasets (
+    name TEXT PRIMARY KEY,
+    position INTEGER,
+    readable_name TEXT,
+    description TEXT,
+    source_fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS catalog_tables (
+    dataset_name TEXT,
+    name TEXT,
+    position INTEGER,
+    readable_name TEXT,
+    description TEXT,
+    last_updated TEXT,
+    type TEXT,
+    row_count INTEGER,
+    fingerprint TEXT,
+    PRIMARY KEY (dataset_name, name)
+);
+CREATE TABLE IF NOT EXISTS catalog_samples (
+    dataset_name TEXT,
+    table_name TEXT,
+    sample BLOB,
+    PRIMARY KEY (dataset_name, table_name)
+);
+CREATE TABLE IF NOT EXISTS catalog_columns (
+    dataset_name TEXT,
+    table_name TEXT,
+    name TEXT,
+    position INTEGER,
+    readable_name TEXT,
+    description TEXT,
+    data_type TEXT,
+    nullable TEXT,
+    min,
+    max,
+    mean REAL,
+    num_distinct INTEGER,
+    num_null INTEGER,
+    num_rows INTEGER,
+    distinct_is_estimate INTEGER,
+    quantiles TEXT,
+    top_values TEXT,
+    PRIMARY KEY (dataset_name, table_name, name)
+);
+"""
+
+def to_sql_value(value):
+    # Catalogs built with pd.read_sql_query hold NumPy scalars, which sqlite3 can't bind
+    return value.item() if hasattr(value, 'item') else value
+
+def to_json(value) -> str | None:
+    return json.dumps(value, default=str) if value is not None else None
+
+def from_json(value: str | None):
+    return json.loads(value) if value is not None else None
+
+class SQLiteStore(MetadataStore):
+    lazy_samples = True
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def connect(self) -> db.Connection:
+        # A connection per call, so the store can be used from any gunicorn thread
+        return db.connect(self.path, timeout=30)
+
+    def load(self) -> Datasets | None:
+        with closing(self.connect()) as conn:
+            datasets = conn.execute("SELECT name, readable_name, description, source_fingerprint FROM catalog_datasets ORDER BY position").fetchall()
+
+            if not datasets:
+                return None
+
+            tables = conn.execute("SELECT dataset_name, name, readable_name, description, last_updated, type, row_count, fingerprint FROM catalog_tables ORDER BY dataset_name, position").fetchall()
+            columns = conn.execute("SELECT dataset_name, table_name, name, readable_name, description, data_type, nullable, min, max, mean, num_distinct, num_null, num_rows, distinct_is_estimate, quantiles, top_values FROM catalog_columns ORDER BY dataset_name, table_name, position").fetchall()
+
+        dsets = Datasets(datasets=[])
+
+        for name, readable_name, description, source_fingerprint in datasets:
+            dsets.add_dataset(Dataset(name=name, readable_name=readable_name, description=description, tables=[], source_fingerprint=source_fingerprint))
+
+        # Samples are left out, see load_sample()
+        for dataset_name, name, readable_name, description, last_updated, type, row_count, fingerprint in tables:
+            table = Table(name=name, readable_name=readable_name, description=description, last_updated=datetime.fromisoformat(last_updated), type=type, columns=[], sample=None, row_count=row_count, fingerprint=fingerprint)
+            dsets.get_dataset(dataset_name).add_table(table)
+
+        for dataset_name, table_name, *fields, distinct_is_estimate, quantiles, top_values in columns:
+            column = Column(*fields, distinct_is_estimate=bool(distinct_is_estimate), quantiles=from_json(quantiles), top_values=[tuple(value) for value in from_json(top_values) or []])
+            dsets.get_dataset(dataset_name).get_table(table_name).columns.append(column)
+
+        return dsets
+
+    def save(self, dsets: Datasets) -> None:
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM catalog_columns")
+            conn.execute("DELETE FROM catalog_tables")
+            conn.execute("DELETE FROM catalog_datasets")
+
+            for dataset_position, dataset in enumerate(dsets.datasets):
+                self._upsert_dataset(conn, dataset, dataset_position)
+
+                for table_position, table in enumerate(dataset.tables):
+                    self._upsert_table(conn, dataset, table, table_position)
+
+                    # Tables loaded from this store have no sample in memory, their saved sample is kept
+                    if table.sample is not None:
+                        conn.execute("INSERT OR REPLACE INTO catalog_samples (dataset_name, table_name, sample) VALUES (?, ?, ?)", (dataset.name, table.name, pickle.dumps(table.sample)))
+
+            conn.execute("DELETE FROM catalog_samples WHERE (dataset_name, table_name) NOT IN (SELECT dataset_name, name FROM catalog_tables)")
+
+    def load_sample(self, dataset_name: str, table_name: str) -> pd.DataFrame | None:
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT sample FROM catalog_samples WHERE dataset_name = ? AND table_name = ?", (dataset_name, table_name)).fetchone()
+
+        return pickle.loads(row[0]) if row is not None else None
+
+    def save_table(self, dsets: Datasets, dataset: Dataset, table: Table) -> None:
+        with closing(self.connect()) as conn, conn:
+            self._upsert_dataset(conn, dataset, dsets.get_dataset_index(dataset.name))
+            self._upsert_table(conn, dataset, table, dataset.get_table_index(table.name))
+
+    def _upsert_dataset(self, conn: db.Connection, dataset: Dataset, position: int) -> None:
+        conn.execute("""
+            INSERT INTO catalog_datasets (name, position, readable_name, description, source_fingerprint) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET position=excluded.position, readable_name=excluded.readable_name, description=excluded.description, source_fingerprint=excluded.source_fingerprint
+            """, (dataset.name, position, dataset.readable_name, dataset.description, dataset.source_fingerprint))
+
+    def _upsert_table(self, conn: db.Connection, dataset: Dataset, table: Table, position: int) -> None:
+        conn.execute("""
+            INSERT INTO catalog_tables (dataset_name, name, position, readable_name, description, last_updated, type, row_count, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (dataset_name, name) DO UPDATE SET position=excluded.position, readable_name=excluded.readable_name, description=excluded.description, last_updated=excluded.last_updated,
+                type=excluded.type, row_count=excluded.row_count, fingerprint=excluded.fingerprint
+            """, (dataset.name, table.name, position, table.readable_name, table.description, table.last_updated.isoformat(), table.type, to_sql_value(table.row_count), table.fingerprint))
+
+        conn.executemany("""
+            INSERT INTO catalog_columns (dataset_name, table_name, name, position, readable_name, description, data_type, nullable, min, max, mean, num_distinct, num_null, num_rows, distinct_is_estimate, quantiles, top_values) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (dataset_name, table_name, name) DO UPDATE SET position=excluded.position, readable_name=excluded.readable_name, description=excluded.description, data_type=excluded.data_type,
+                nullable=excluded.nullable, min=excluded.min, max=excluded.max, mean=excluded.mean, num_distinct=excluded.num_distinct, num_null=excluded.num_null, num_rows=excluded.num_rows,
+                distinct_is_estimate=excluded.distinct_is_estimate, quantiles=excluded.quantiles, top_values=excluded.top_values
+            """, [(dataset.name, table.name, column.name, position, column.readable_name, column.description, column.data_type, column.nullable, *map(to_sql_value, (column.min, column.max, column.mean, column.num_distinct, column.num_null, column.num_rows)), column.distinct_is_estimate, to_json(column.quantiles), to_json(column.top_values)) for position, column in enumerate(table.columns)])
@@ -0,0 +1,204 @@
+# Benchmarks for Portfolio Volatility.
+# Run this using `python3 benchmark.py` from the portfolio-volatility directory. It uses the
+# synthetic price source, so it doesn't need Snowflake.
+import datetime
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pool
+import prices
+import risk
+
+TICKERS = ["AAPL", "MSFT", "AMZN", "GOOG", "FB"]
+
+def timeit(fn, repeat: int = 5) -> float:
+    """Returns the best wall time in seconds over `repeat` runs"""
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def bench_price_store(latency: float = 1.0) -> None:
+    """Page data load with a cold and a warm price store, the source taking `latency` seconds per fetch like a remote warehouse"""
+    path = os.path.join(tempfile.mkdtemp(), "prices.db")
+    source = prices.SyntheticSource(latency=latency)
+
+    cold = timeit(lambda: prices.PriceStore(path, source).get(TICKERS), repeat=1)
+    store = prices.PriceStore(path, source)
+    from_disk = timeit(lambda: prices.PriceStore(path, source).get(TICKERS), repeat=3)
+    warm = timeit(lambda: store.get(TICKERS))
+    one_new = timeit(lambda: store.get(TICKERS + ["NVDA"]), repeat=1)
+
+    print(f"Prices for {len(TICKERS)} tickers (source latency {latency:.1f}s)")
+    print(f"  cold store:            {cold * 1000:8.1f} ms")
+    print(f"  store on disk:         {from_disk * 1000:8.1f} ms")
+    print(f"  store in memory:       {warm * 1000:8.1f} ms")
+    print(f"  with one new ticker:   {one_new * 1000:8.1f} ms")
+
+class FakeConnection:
+    """Stands in for a warehouse connection, with the cost of opening one"""
+    def __init__(self, connect_latency: float):
+        time.sleep(connect_latency)
+
+    def close(self) -> None:
+        pass
+
+def bench_connection_pool(users: int = 8, requests: int = 10, connect_latency: float = 0.5, query_latency: float = 0.05) -> None:
+    """Concurrent users each running queries, with a new connection per query and with the pool"""
+    def run(checkout) -> float:
+        def user():
+            for _ in range(requests):
+                checkout()
+
+        threads = [threading.Thread(target=user) for _ in range(users)]
+        start = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return time.perf_counter() - start
+
+    def per_query():
+        conn = FakeConnection(connect_latency)
+        time.sleep(query_latency)
+        conn.close()
+
+    connections = pool.ConnectionPool(lambda: FakeConnection(connect_latency), max_size=4)
+
+    def pooled():
+        with connections.connection():
+            time.sleep(query_latency)
+
+    unpooled = run(per_query)
+    with_pool = run(pooled)
+    stats = connections.stats()
+
+    print(f"{users} users x {requests} queries (connect {connect_latency:.2f}s, query {query_latency:.2f}s)")
+    print(f"  connection per query:  {unpooled * 1000:8.1f} ms")
+    print(f"  pool of {connections.max_size}:             {with_pool * 1000:8.1f} ms")
+    print(f"  connections opened:    {stats['opened']:8d}")
+    print(f"  checkout wait mean:    {stats['wait_ms_mean']:8.1f} ms")
+    print(f"  checkout wait p95:     {stats['wait_ms_p95']:8.1f} ms")
+
+def pandas_risk(data: pd.DataFrame, tickers_and_weights: dict) -> dict:
+    """The page's calculations as they were before the risk engine, on the long format frame"""
+    data = data.copy()
+    data["return"] = data.groupby("ticker")["closeadj"].pct_change()
+    data['weighted_return'] = data['return'] * data['ticker'].map(tickers_and_weights)
+    portfolio_return = data.groupby("date")["weighted_return"].sum()
+    tail_cutoff = data.groupby("date")["weighted_return"].sum().quantile(0.025)
+
+    first_date, last_date = data["date"].min(), data["date"].max()
+    ticker_volatility = data.groupby("ticker")["return"].std() * 252 ** 0.5
+    total_returns = data[data["date"] == last_date].set_index("ticker")["closeadj"] / data[data["date"] == first_date].set_index("ticker")["closeadj"] - 1
+
+    return {
+        'portfolio_return': portfolio_return,
+        'cumulative_return': (1 + portfolio_return).cumprod() - 1,
+        'volatility': portfolio_return.std() * 252 ** 0.5,
+        'var': tail_cutoff * 252 ** 0.5,
+        'es': portfolio_return[portfolio_return < tail_cutoff].mean() * 252 ** 0.5,
+        'return_vs_volatility': total_returns.to_frame("total_return").join(ticker_volatility.to_frame("volatility")),
+        'correlation': data.pivot(index="date", columns="ticker", values="return").corr(),
+    }
+
+def bench_risk(n_tickers: int = 500, years: int = 20) -> None:
+    """Risk engine against the pandas calculations, for an equally weighted portfolio"""
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    first_date = datetime.date.today() - datetime.timedelta(days=365 * years)
+    data = prices.SyntheticSource(first_date).fetch(tickers)
+
+    # Some tickers listed later, as in real data
+    data = data[~(data['ticker'].isin(tickers[::10]) & (data['date'] < pd.Timestamp(first_date) + pd.Timedelta(days=365 * 5)))]
+    data = data.sort_values(["date", "ticker"], ignore_index=True)
+    tickers_and_weights = {ticker: 1 / n_tickers for ticker in tickers}
+
+    expected = pandas_risk(data, tickers_and_weights)
+    actual = risk.analyze(risk.RiskModel(risk.Returns.from_prices(data)), tickers_and_weights)
+
+    for key in ['volatility', 'var', 'es']:
+        assert np.isclose(expected[key], actual[key]), key
+
+    assert np.allclose(expected['portfolio_return'].to_numpy(), actual['portfolio_return'].to_numpy())
+    assert np.allclose(expected['return_vs_volatility'].to_numpy(), actual['return_vs_volatility'].to_numpy(), equal_nan=True)
+    assert np.allclose(expected['correlation'].to_numpy(), actual['correlation'].to_numpy(), atol=1e-9, equal_nan=True)
+
+    with_pandas = timeit(lambda: pandas_risk(data, tickers_and_weights), repeat=3)
+    with_engine = timeit(lambda: risk.analyze(risk.RiskModel(risk.Returns.from_prices(data)), tickers_and_weights), repeat=3)
+
+    print(f"Risk for {n_tickers} tickers x {years} years ({len(data)} prices)")
+    print(f"  pandas:                {with_pandas * 1000:8.1f} ms")
+    print(f"  risk engine:           {with_engine * 1000:8.1f} ms")
+
+def bench_reweight(n_tickers: int = 5, years: int = 20) -> None:
+    """Risk for new weights on the same tickers, from scratch and from the cached risk model"""
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    first_date = datetime.date.today() - datetime.timedelta(days=365 * years)
+    data = prices.SyntheticSource(first_date).fetch(tickers).sort_values(["date", "ticker"], ignore_index=True)
+    model = risk.RiskModel(risk.Returns.from_prices(data))
+    rng = np.random.default_rng(0)
+
+    def new_weights() -> dict:
+        weights = rng.random(n_tickers)
+        return dict(zip(tickers, weights / weights.sum()))
+
+    tickers_and_weights = new_weights()
+    expected = risk.portfolio_risk(model.scenarios @ model.returns.weights(tickers_and_weights))
+    actual = model.risk(tickers_and_weights)
+
+    for key in ['volatility', 'var', 'es']:
+        assert np.isclose(expected[key], actual[key]), key
+
+    from_scratch = timeit(lambda: risk.analyze(risk.RiskModel(risk.Returns.from_prices(data)), new_weights()))
+    cached = timeit(lambda: model.risk(new_weights()), repeat=100)
+
+    print(f"Reweighting {n_tickers} tickers x {years} years")
+    print(f"  from prices:           {from_scratch * 1000:8.3f} ms")
+    print(f"  from the risk model:   {cached * 1000:8.3f} ms")
+
+def bench_rolling(n_tickers: int = 1000, years: int = 20, window: int = 63) -> None:
+    """Rolling and EWMA volatility and rolling correlation with the portfolio, for every ticker, against pandas and recomputing each window"""
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    first_date = datetime.date.today() - datetime.timedelta(days=365 * years)
+    data = prices.SyntheticSource(first_date).fetch(tickers)
+    data = data[~(data['ticker'].isin(tickers[::10]) & (data['date'] < pd.Timestamp(first_date) + pd.Timedelta(days=365 * 5)))]
+    returns = risk.Returns.from_prices(data.sort_values(["date", "ticker"], ignore_index=True))
+    portfolio_return = np.nan_to_num(returns.returns).mean(axis=1)
+    frame = pd.DataFrame(returns.returns)
+
+    expected = frame.rolling(window).std().to_numpy() * 252 ** 0.5
+    assert np.allclose(expected, risk.rolling_volatility(returns.returns, window), equal_nan=True)
+
+    expected = np.sqrt((frame ** 2).ewm(alpha=1 - risk.EWMA_DECAY, adjust=False).mean().to_numpy() * 252)
+    assert np.allclose(expected, risk.ewma_volatility(returns.returns), equal_nan=True)
+
+    expected = frame.rolling(window).corr(pd.Series(portfolio_return)).to_numpy()
+    assert np.allclose(expected, risk.rolling_correlation(returns.returns, portfolio_return, window), atol=1e-9, equal_nan=True)
+
+    def each_window():
+        # Every window recomputed from scratch, for comparison
+        return [np.std(returns.returns[end - window:end], axis=0, ddof=1) for end in range(window, len(returns.returns) + 1)]
+
+    print(f"Rolling {window} day statistics for {n_tickers} tickers x {years} years")
+    print(f"  volatility, windows:   {timeit(each_window, repeat=1) * 1000:8.1f} ms")
+    print(f"  volatility:            {timeit(lambda: risk.rolling_volatility(returns.returns, window), repeat=3) * 1000:8.1f} ms")
+    print(f"  EWMA volatility:       {timeit(lambda: risk.ewma_volatility(returns.returns), repeat=3) * 1000:8.1f} ms")
+    print(f"  correlation, pandas:   {timeit(lambda: frame.rolling(window).corr(pd.Series(portfolio_return)), repeat=3) * 1000:8.1f} ms")
+    print(f"  correlation:           {timeit(lambda: risk.rolling_correlation(returns.returns, portfolio_return, window), repeat=3) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    bench_price_store()
+    bench_connection_pool()
+    bench_risk()
+    bench_reweight()
+    bench_rolling()
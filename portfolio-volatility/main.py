@@ -1,10 +1,27 @@
 import pycob as cob
 import pandas as pd
 import plotly.express as px
-import snowflake.connector
+import math
+import os
+import time
+import flask
+import prices
+import risk
 
 app = cob.App("Portfolio Volatility")
 
+# Prices come from Snowflake, or from random walks with PRICE_SOURCE=synthetic to work offline
+if os.environ.get("PRICE_SOURCE") == "synthetic":
+    price_source = prices.SyntheticSource()
+else:
+    price_source = prices.SnowflakeSource(app)
+
+# Prices are kept locally and only missing dates are fetched from the source
+price_store = prices.PriceStore("prices.db", price_source)
+
+# Risk models of recently used sets of tickers, so reweighting a portfolio doesn't go back to the prices
+risk_models = risk.ModelCache(max_models=100, max_age=prices.REFRESH_AFTER)
+
 initial_tickers_and_weights = {
     "AAPL": 0.2,
     "MSFT": 0.2,
@@ -15,25 +32,20 @@ initial_tickers_and_weights = {
 
 def get_data(app: cob.App, tickers: list) -> pd.DataFrame:
     """Get the data for the tickers"""
-    # Get the data
-    conn = snowflake.connector.connect(
-        user=app.retrieve_secret("SNOWFLAKE_USER"),
-        password=app.retrieve_secret("SNOWFLAKE_PASSWORD"),
-        account=app.retrieve_secret("SNOWFLAKE_ACCOUNT"),
-        )
-    cs = conn.cursor()
-
-    # Load data for tickers
-    cur = cs.execute(f"""
-    SELECT "ticker", "date", "closeadj"
-    FROM QUANDL.TYPED.SEP
-    WHERE "ticker" in ({', '.join([f"'{ticker}'" for ticker in tickers])})
-    ORDER BY "date"
-    """)
-
-    data = cur.fetch_pandas_all()
-
-    return data
+    return price_store.get(list(tickers))
+
+def get_risk_model(app: cob.App, tickers: list) -> risk.RiskModel:
+    """The risk model for a set of tickers, built from their prices the first time"""
+    model = risk_models.get(tickers, price_store.version(tickers))
+
+    if model is None:
+        # Fetch anything missing first, so the model is kept under the version of the prices it's built from
+        price_store.update(tickers)
+        version = price_store.version(tickers)
+        model = risk.RiskModel(risk.Returns.from_prices(get_data(app, tickers)))
+        risk_models.put(tickers, version, model)
+
+    return model
 
 def update_tickers_and_weights(before: dict, ticker: str, weight: float) -> dict:
     after = before.copy()
@@ -47,36 +59,6 @@ def update_tickers_and_weights(before: dict, ticker: str, weight: float) -> dict
 
     return after
 
-def compute_daily_returns(data: pd.DataFrame) -> pd.DataFrame:
-    data["return"] = data.groupby("ticker")["closeadj"].pct_change()
-
-    return data
-
-def compute_portfolio_returns(data: pd.DataFrame, tickers_and_weights: dict) -> pd.DataFrame:
-    data['weighted_return'] = data['return'] * data['ticker'].map(tickers_and_weights)
-
-    portfolio_return = data.groupby("date")["weighted_return"].sum()
-
-    return portfolio_return
-
-def get_return_vs_volatility(data: pd.DataFrame) -> pd.DataFrame:
-    # First Date
-    first_date = data["date"].min()
-
-    # Last Date
-    last_date = data["date"].max()
-
-    # Ticker volatility
-    ticker_volatility = data.groupby("ticker")["return"].std() * 252 ** 0.5
-
-    # Compute the total returns using the first date and last date and closeadj
-    total_returns = data[data["date"] == last_date].set_index("ticker")["closeadj"] / data[data["date"] == first_date].set_index("ticker")["closeadj"] - 1
-
-    # Join ticker_volatility and total_returns
-    return_vs_volatility = total_returns.to_frame("total_return").join(ticker_volatility.to_frame("volatility"))
-
-    return return_vs_volatility
-
 # Page Functions
 def home(server_request: cob.Request) -> cob.Page:
     page = cob.Page("Portfolio Volatility")
@@ -90,23 +72,14 @@ def home(server_request: cob.Request) -> cob.Page:
     else:
         tickers_and_weights = initial_tickers_and_weights
 
-    # Get the data
-    data = get_data(server_request.app, tickers_and_weights.keys())
-    data = compute_daily_returns(data)
-    portfolio_return = compute_portfolio_returns(data, tickers_and_weights)
-
-    # Calculate the portfolio volatility
-    portfolio_volatility = portfolio_return.std() * 252 ** 0.5
-
-    # Compute the portfolio cumulative return
-    portfolio_cumulative_return = (1+portfolio_return).cumprod()-1
-
-    # Compute portfolio Value at Risk
-    tail_cutoff = data.groupby("date")["weighted_return"].sum().quantile(0.025)
-    portfolio_var = tail_cutoff * 252 ** 0.5
-
-    # Compute portfolio Expected Shortfall
-    portfolio_es = portfolio_return[portfolio_return < tail_cutoff].mean() * 252 ** 0.5
+    # Returns, risk and correlation, from one dates x tickers matrix
+    model = get_risk_model(server_request.app, list(tickers_and_weights.keys()))
+    results = risk.analyze(model, tickers_and_weights)
+    portfolio_return = results['portfolio_return']
+    portfolio_cumulative_return = results['cumulative_return']
+    portfolio_volatility = results['volatility']
+    portfolio_var = results['var']
+    portfolio_es = results['es']
 
     # Plotly Histogram of the returns
     fig1 = px.histogram(portfolio_return, x="weighted_return", nbins=100, title="<b>Daily Portfolio Return Distribution<b>")
@@ -117,15 +90,19 @@ def home(server_request: cob.Request) -> cob.Page:
     fig2.layout.yaxis.tickformat = ',.0%'
 
     # Plotly Scatter of the returns vs volatility
-    return_vs_volatility = get_return_vs_volatility(data)
+    return_vs_volatility = results['return_vs_volatility']
     fig3 = px.scatter(return_vs_volatility.reset_index(), x="volatility", y="total_return", title="<b>Returns vs Volatility</b>", text="ticker")
     fig3.update_traces(textposition="bottom right")
 
-    # Compute the correlation matrix
-    correlation_matrix = data.pivot(index="date", columns="ticker", values="return").corr()
-
     # Plotly Heatmap of the correlation matrix
-    fig4 = px.imshow(correlation_matrix, title="<b>Correlation Matrix</b>")
+    fig4 = px.imshow(results['correlation'], title="<b>Correlation Matrix</b>")
+
+    # Plotly Rolling and EWMA volatility of the portfolio
+    fig5 = px.line(results['rolling_volatility'], title="<b>Rolling Portfolio Volatility</b>", labels={"value": "volatility", "variable": "window"})
+    fig5.layout.yaxis.tickformat = ',.0%'
+
+    # Plotly Rolling correlation of each ticker with the portfolio
+    fig6 = px.line(results['rolling_correlation'], title=f"<b>{risk.ROLLING_WINDOWS[1]} Day Correlation with the Portfolio</b>", labels={"value": "correlation"})
 
     with page.add_container(grid_columns=3) as risk_stats:
         with risk_stats.add_card() as card:
@@ -148,6 +125,10 @@ def home(server_request: cob.Request) -> cob.Page:
         plots2.add_plotlyfigure(fig3)
         plots2.add_plotlyfigure(fig4)
 
+    with page.add_container(grid_columns=2) as plots3:
+        plots3.add_plotlyfigure(fig5)
+        plots3.add_plotlyfigure(fig6)
+
     with page.add_card() as card:
         card.add_header("Portfolio Tickers and Weights")
         card.add_pandastable(pd.Series(tickers_and_weights).to_frame("weights").reset_index(names="tickers"))
@@ -160,9 +141,49 @@ def home(server_request: cob.Request) -> cob.Page:
 
     return page
 
+def data_status(server_request: cob.Request) -> cob.Page:
+    page = cob.Page("Data Status")
+
+    with page.add_card() as card:
+        card.add_header("Warehouse Connections")
+
+        if isinstance(price_source, prices.SnowflakeSource):
+            stats = price_source.pool.stats()
+            card.add_pandastable(pd.Series(stats).to_frame("value").reset_index(names="metric"))
+        else:
+            card.add_text("Prices come from the synthetic source, there are no warehouse connections.")
+
+    return page
+
 
 # Add the pages
 app.register_function(home)
+app.register_function(data_status, show_in_navbar=False)
+
+@app.flask_app.route("/api/risk")
+def risk_api():
+    """Portfolio risk for a new weight, e.g. /api/risk?ticker=AAPL&weight=0.3, for a slider to call as it moves"""
+    ticker = flask.request.args.get("ticker", "")
+    weight = flask.request.args.get("weight", "")
+
+    try:
+        tickers_and_weights = update_tickers_and_weights(initial_tickers_and_weights, ticker, float(weight)) if ticker != "" and weight != "" else initial_tickers_and_weights
+
+        # nan or inf would make the response invalid JSON
+        if not all(math.isfinite(value) for value in tickers_and_weights.values()):
+            raise ValueError(weight)
+    except (ValueError, ZeroDivisionError):
+        return flask.jsonify({'error': f"Invalid weight: {weight}"}), 400
+
+    start = time.perf_counter()
+    model = get_risk_model(app, list(tickers_and_weights.keys()))
+    results = model.risk(tickers_and_weights)
+
+    return flask.jsonify({
+        'tickers_and_weights': tickers_and_weights,
+        **{key: None if pd.isna(value) else float(value) for key, value in results.items()},
+        'milliseconds': (time.perf_counter() - start) * 1000,
+    })
 
 # Run the app
-server = app.run()
\ No newline at end of file
+server = app.run()
@@ -0,0 +1,194 @@
+# Connection pool for Portfolio Volatility.
+# Warehouse connections are expensive to open (secrets lookup plus a login handshake), so
+# they are shared by the gunicorn threads through a bounded pool. Connections that were
+# idle for a while are checked before use, connections idle for too long are closed (also
+# by a background thread, so they don't stay open while nothing uses the pool), and the
+# time spent waiting for a connection is recorded.
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, connect, max_size: int = 4, max_idle: float = 300, check_after: float = 30, checkout_timeout: float = 60, is_healthy=None):
+        # connect() opens a new connection, is_healthy(conn) returns False for a broken one
+        self.connect = connect
+        self.max_size = max_size
+        # Idle connections are closed after max_idle seconds, and checked before use after check_after seconds
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.checkout_timeout = checkout_timeout
+        self.is_healthy = is_healthy or (lambda conn: True)
+        self.condition = threading.Condition()
+        # (connection, time it was returned), most recently returned last
+        self.idle = []
+        self.size = 0
+        # Metrics
+        self.checkouts = 0
+        self.opened = 0
+        self.closed = 0
+        self.wait_times = deque(maxlen=1000)
+        # Closes idle connections in the background, started when the first connection is returned
+        self.reaper = None
+        self.stop_event = threading.Event()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        healthy = True
+
+        try:
+            yield conn
+        except Exception:
+            # The error may have come from the connection itself
+            healthy = self.safe_is_healthy(conn)
+            raise
+        finally:
+            self.checkin(conn, healthy)
+
+    def checkout(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.checkout_timeout
+
+        while True:
+            expired = []
+            conn = None
+            returned_at = None
+            open_new = False
+
+            with self.condition:
+                expired = self.evict_idle()
+
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        self.close_all(expired)
+                        raise PoolTimeout(f"No connection available after {self.checkout_timeout:g}s")
+
+                if self.idle:
+                    conn, returned_at = self.idle.pop()
+                else:
+                    # Reserve the slot, the connection is opened outside the lock
+                    self.size += 1
+                    open_new = True
+
+            self.close_all(expired)
+
+            if open_new:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+
+                    raise
+
+                with self.condition:
+                    self.opened += 1
+            elif time.time() - returned_at > self.check_after and not self.safe_is_healthy(conn):
+                self.discard(conn)
+                continue
+
+            with self.condition:
+                self.checkouts += 1
+                self.wait_times.append(time.perf_counter() - start)
+
+            return conn
+
+    def checkin(self, conn, healthy: bool = True) -> None:
+        if not healthy:
+            self.discard(conn)
+            return
+
+        with self.condition:
+            self.idle.append((conn, time.time()))
+            self.condition.notify()
+            expired = self.evict_idle()
+
+        self.close_all(expired)
+        self.start_reaper()
+
+    def start_reaper(self) -> None:
+        with self.condition:
+            if self.reaper is not None or self.stop_event.is_set():
+                return
+
+            self.reaper = threading.Thread(target=self.reap, name="pool reaper", daemon=True)
+
+        self.reaper.start()
+
+    def reap(self) -> None:
+        # Checking twice per max_idle closes a connection at most 1.5 * max_idle after it was returned
+        while not self.stop_event.wait(self.max_idle / 2):
+            with self.condition:
+                expired = self.evict_idle()
+
+            self.close_all(expired)
+
+    def discard(self, conn) -> None:
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+        self.close_all([conn])
+
+    def evict_idle(self) -> list:
+        """Takes the connections idle for longer than max_idle out of the pool, to be closed outside the lock"""
+        now = time.time()
+        expired = [conn for conn, returned_at in self.idle if now - returned_at > self.max_idle]
+
+        if expired:
+            self.idle = [(conn, returned_at) for conn, returned_at in self.idle if now - returned_at <= self.max_idle]
+            self.size -= len(expired)
+
+        return expired
+
+    def close_all(self, connections: list) -> None:
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        if connections:
+            with self.condition:
+                self.closed += len(connections)
+
+    def safe_is_healthy(self, conn) -> bool:
+        try:
+            return self.is_healthy(conn)
+        except Exception:
+            return False
+
+    def stats(self) -> dict:
+        with self.condition:
+            wait_times = sorted(self.wait_times)
+
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'opened': self.opened,
+                'closed': self.closed,
+                'wait_ms_mean': 1000 * sum(wait_times) / len(wait_times) if wait_times else 0,
+                'wait_ms_p95': 1000 * wait_times[int(0.95 * (len(wait_times) - 1))] if wait_times else 0,
+                'wait_ms_max': 1000 * wait_times[-1] if wait_times else 0,
+            }
+
+    def close(self) -> None:
+        self.stop_event.set()
+
+        with self.condition:
+            idle = [conn for conn, _ in self.idle]
+            self.idle = []
+            self.size -= len(idle)
+
+        self.close_all(idle)
@@ -0,0 +1,246 @@
+# Price data for Portfolio Volatility.
+# Prices come from a source (Snowflake, or a synthetic stand-in for working offline) and
+# are kept in a local SQLite store, one row per ticker and date, clustered by ticker then
+# date. The store is read first; only the dates a ticker is missing are fetched from the
+# source and appended. Recently used tickers are also kept in memory.
+from __future__ import annotations
+import datetime
+import sqlite3 as db
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import closing
+import numpy as np
+import pandas as pd
+import pool
+
+# Sources are asked for new prices of a ticker at most this often
+REFRESH_AFTER = 12 * 60 * 60
+
+# Price histories kept in memory, least recently used are dropped first
+MAX_CACHED_TICKERS = 2000
+
+# Snowflake connections shared by all requests, closed after 10 minutes unused
+WAREHOUSE_POOL_SIZE = 4
+WAREHOUSE_MAX_IDLE = 10 * 60
+
+class PriceSource:
+    def fetch(self, tickers: list[str], start: datetime.date | None = None) -> pd.DataFrame:
+        """Adjusted closes of the tickers from start (or the beginning of their history) onwards,
+        as a frame with columns ticker, date and closeadj"""
+        raise NotImplementedError
+
+class SnowflakeSource(PriceSource):
+    """Sharadar equity prices (QUANDL.TYPED.SEP) on Snowflake"""
+    def __init__(self, app, pool_size: int = WAREHOUSE_POOL_SIZE, max_idle: float = WAREHOUSE_MAX_IDLE):
+        self.app = app
+        self.credentials = None
+        self.pool = pool.ConnectionPool(self.connect, max_size=pool_size, max_idle=max_idle, is_healthy=self.is_healthy)
+
+    def connect(self):
+        # Only needed when this source is used
+        import snowflake.connector
+
+        # The secrets are looked up once, not for every connection
+        if self.credentials is None:
+            self.credentials = {
+                'user': self.app.retrieve_secret("SNOWFLAKE_USER"),
+                'password': self.app.retrieve_secret("SNOWFLAKE_PASSWORD"),
+                'account': self.app.retrieve_secret("SNOWFLAKE_ACCOUNT"),
+            }
+
+        try:
+            return snowflake.connector.connect(**self.credentials)
+        except Exception:
+            # Look them up again next time, in case they were rotated
+            self.credentials = None
+            raise
+
+    def is_healthy(self, conn) -> bool:
+        if conn.is_closed():
+            return False
+
+        conn.cursor().execute("SELECT 1").fetchone()
+
+        return True
+
+    def fetch(self, tickers: list[str], start: datetime.date | None = None) -> pd.DataFrame:
+        with self.pool.connection() as conn:
+            return self.query(conn, tickers, start)
+
+    def query(self, conn, tickers: list[str], start: datetime.date | None) -> pd.DataFrame:
+        cs = conn.cursor()
+
+        # Load data for tickers
+        cur = cs.execute(f"""
+        SELECT "ticker", "date", "closeadj"
+        FROM QUANDL.TYPED.SEP
+        WHERE "ticker" in ({', '.join(['%s'] * len(tickers))})
+        {'AND "date" >= %s' if start is not None else ''}
+        ORDER BY "date"
+        """, [*tickers] + ([start] if start is not None else []))
+
+        return cur.fetch_pandas_all()
+
+class SyntheticSource(PriceSource):
+    """Random walk prices on business days, the same for a ticker every time. For working offline."""
+    def __init__(self, first_date: datetime.date = datetime.date(2000, 1, 3), latency: float = 0):
+        self.first_date = first_date
+        # Seconds added to each fetch, to stand in for a remote source
+        self.latency = latency
+
+    def fetch(self, tickers: list[str], start: datetime.date | None = None) -> pd.DataFrame:
+        time.sleep(self.latency)
+
+        dates = pd.bdate_range(self.first_date, datetime.date.today())
+        frames = []
+
+        for ticker in tickers:
+            rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+            daily_returns = rng.normal(0.0004, 0.01 + 0.02 * rng.random(), len(dates))
+            closeadj = 10 * (1 + rng.random()) * np.cumprod(1 + daily_returns)
+            frame = pd.DataFrame({'ticker': ticker, 'date': dates, 'closeadj': closeadj})
+
+            if start is not None:
+                frame = frame[frame['date'] >= pd.Timestamp(start)]
+
+            frames.append(frame)
+
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ticker', 'date', 'closeadj'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    ticker TEXT,
+    date TEXT,
+    closeadj REAL,
+    PRIMARY KEY (ticker, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    ticker TEXT PRIMARY KEY,
+    last_date TEXT,
+    checked_at REAL
+);
+"""
+
+class PriceStore:
+    def __init__(self, path: str, source: PriceSource, refresh_after: float = REFRESH_AFTER, max_cached_tickers: int = MAX_CACHED_TICKERS):
+        self.path = path
+        self.source = source
+        self.refresh_after = refresh_after
+        self.max_cached_tickers = max_cached_tickers
+        # ticker -> prices, as read from the store
+        self.frames = OrderedDict()
+        self.frames_lock = threading.Lock()
+        # ticker -> goes up whenever prices are added for it, for caches of values computed from them
+        self.versions = {}
+        # One fetch from the source at a time, so concurrent requests don't fetch the same prices
+        self.fetch_lock = threading.Lock()
+
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def connect(self) -> db.Connection:
+        # A connection per call, so the store can be used from any gunicorn thread
+        return db.connect(self.path, timeout=30)
+
+    def get(self, tickers: list[str]) -> pd.DataFrame:
+        """Prices of the tickers, fetching what the store is missing first"""
+        tickers = list(dict.fromkeys(tickers))
+        self.update(tickers)
+
+        with self.frames_lock:
+            frames = {ticker: self.frames[ticker] for ticker in tickers if ticker in self.frames}
+
+            for ticker in frames:
+                self.frames.move_to_end(ticker)
+
+        missing = [ticker for ticker in tickers if ticker not in frames]
+
+        if missing:
+            loaded = self.read(missing)
+
+            with self.frames_lock:
+                for ticker, frame in loaded.items():
+                    frames[ticker] = self.frames[ticker] = frame
+
+                while len(self.frames) > self.max_cached_tickers:
+                    self.frames.popitem(last=False)
+
+        data = pd.concat([frames[ticker] for ticker in tickers if ticker in frames], ignore_index=True)
+
+        # Callers add columns to the frame, so it's a copy of the cached ones
+        return data.sort_values(["date", "ticker"], kind="stable", ignore_index=True)
+
+    def version(self, tickers: list[str]) -> tuple:
+        """Changes when prices are added for any of the tickers"""
+        with self.frames_lock:
+            return tuple(self.versions.get(ticker, 0) for ticker in sorted(set(tickers)))
+
+    def read(self, tickers: list[str]) -> dict:
+        with closing(self.connect()) as conn:
+            data = pd.read_sql_query(f"SELECT ticker, date, closeadj FROM prices WHERE ticker IN ({', '.join(['?'] * len(tickers))}) ORDER BY ticker, date", conn, params=tickers)
+
+        data['date'] = pd.to_datetime(data['date'], format='%Y-%m-%d')
+
+        # Tickers the source doesn't know have an empty frame, so they aren't looked up again
+        frames = {ticker: data.iloc[0:0] for ticker in tickers}
+        frames.update({ticker: frame.reset_index(drop=True) for ticker, frame in data.groupby('ticker', sort=False)})
+
+        return frames
+
+    def stale(self, tickers: list[str]) -> dict:
+        """Tickers due a fetch -> the first date to fetch, None for the whole history"""
+        with closing(self.connect()) as conn:
+            coverage = {ticker: (last_date, checked_at) for ticker, last_date, checked_at in conn.execute(f"SELECT ticker, last_date, checked_at FROM coverage WHERE ticker IN ({', '.join(['?'] * len(tickers))})", tickers)}
+
+        now = time.time()
+        stale = {}
+
+        for ticker in tickers:
+            if ticker not in coverage:
+                stale[ticker] = None
+            elif now - coverage[ticker][1] > self.refresh_after:
+                last_date = coverage[ticker][0]
+                stale[ticker] = datetime.date.fromisoformat(last_date) + datetime.timedelta(days=1) if last_date else None
+
+        return stale
+
+    def update(self, tickers: list[str]) -> None:
+        if not self.stale(tickers):
+            return
+
+        with self.fetch_lock:
+            # Another thread may have fetched them while this one waited
+            stale = self.stale(tickers)
+
+            # One fetch per start date, e.g. all new tickers together
+            by_start = {}
+
+            for ticker, start in stale.items():
+                by_start.setdefault(start, []).append(ticker)
+
+            for start, group in by_start.items():
+                self.append(group, self.source.fetch(group, start))
+
+    def append(self, tickers: list[str], data: pd.DataFrame) -> None:
+        data = data.rename(columns=str.lower)
+        dates = pd.to_datetime(data['date']).dt.strftime('%Y-%m-%d')
+        rows = list(zip(data['ticker'], dates, data['closeadj'].astype(float)))
+
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO prices (ticker, date, closeadj) VALUES (?, ?, ?)", rows)
+
+            # Tickers the source has nothing new for are still marked as checked
+            for ticker in tickers:
+                conn.execute("""
+                    INSERT INTO coverage (ticker, last_date, checked_at) VALUES (?, (SELECT MAX(date) FROM prices WHERE ticker = ?), ?)
+                    ON CONFLICT (ticker) DO UPDATE SET last_date=excluded.last_date, checked_at=excluded.checked_at
+                    """, (ticker, ticker, time.time()))
+
+        # Dropped once the new prices are in the store, so they aren't read back without them
+        with self.frames_lock:
+            for ticker in tickers:
+                self.frames.pop(ticker, None)
+                self.versions[ticker] = self.versions.get(ticker, 0) + 1
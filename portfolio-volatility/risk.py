@@ -0,0 +1,241 @@
+# Risk engine for Portfolio Volatility.
+# Prices are pivoted once into a dates x tickers matrix, and everything on the page is
+# computed from that matrix with NumPy: daily returns, the portfolio return as a product
+# with the weights, volatility, Value at Risk, Expected Shortfall, per ticker return and
+# volatility, and the correlation matrix.
+# The parts that don't depend on the weights are kept per set of tickers, so a portfolio
+# that is only reweighted is priced without going back to the prices.
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+
+# Value at Risk and Expected Shortfall are taken at this quantile of daily returns
+TAIL = 0.025
+
+# Rolling windows in trading days: a month, a quarter and a year
+ROLLING_WINDOWS = [21, 63, 252]
+
+# RiskMetrics decay for EWMA volatility
+EWMA_DECAY = 0.94
+
+class Returns:
+    def __init__(self, dates: pd.DatetimeIndex, tickers: list[str], prices: np.ndarray):
+        self.dates = dates
+        self.tickers = tickers
+        # dates x tickers, NaN where a ticker has no price on a date
+        self.prices = prices
+
+        # A ticker's return is from its previous price, also across dates it has no price on.
+        # The first date and dates without a price have no return.
+        filled = pd.DataFrame(prices).ffill().to_numpy()
+        self.returns = np.full_like(prices, np.nan)
+        self.returns[1:] = filled[1:] / filled[:-1] - 1
+        self.returns[np.isnan(prices)] = np.nan
+
+    @classmethod
+    def from_prices(cls, data: pd.DataFrame) -> Returns:
+        """From long format prices with columns ticker, date and closeadj"""
+        date_codes, dates = pd.factorize(data["date"], sort=True)
+        ticker_codes, tickers = pd.factorize(data["ticker"], sort=True)
+
+        prices = np.full((len(dates), len(tickers)), np.nan)
+        prices[date_codes, ticker_codes] = data["closeadj"].to_numpy(dtype=float)
+
+        return cls(pd.DatetimeIndex(dates), list(tickers), prices)
+
+    def weights(self, tickers_and_weights: dict) -> np.ndarray:
+        """Weights in the order of the matrix columns, 0 for tickers not in the portfolio"""
+        return np.array([tickers_and_weights.get(ticker, 0.0) for ticker in self.tickers], dtype=float)
+
+    def ticker_stats(self) -> pd.DataFrame:
+        """Total return over the whole period and annualized volatility of each ticker"""
+        total_return = self.prices[-1] / self.prices[0] - 1
+        volatility = np.nanstd(self.returns, axis=0, ddof=1) * TRADING_DAYS ** 0.5
+
+        return pd.DataFrame({'total_return': total_return, 'volatility': volatility}, index=pd.Index(self.tickers, name="ticker"))
+
+    def correlation(self) -> pd.DataFrame:
+        """Pearson correlation of daily returns, each pair over the dates both tickers have a return"""
+        present = (~np.isnan(self.returns)).astype(float)
+        x = np.nan_to_num(self.returns)
+
+        # Sums over the dates both tickers of a pair have a return, all pairs at once
+        n = present.T @ present
+        sum_x = x.T @ present
+        sum_xx = (x * x).T @ present
+        sum_xy = x.T @ x
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = sum_xy - sum_x * sum_x.T / n
+            variance_x = sum_xx - sum_x ** 2 / n
+            correlation = covariance / np.sqrt(variance_x * variance_x.T)
+
+        correlation[n < 2] = np.nan
+        np.fill_diagonal(correlation, np.where(np.diag(n) >= 2, 1.0, np.nan))
+
+        return pd.DataFrame(np.clip(correlation, -1, 1), index=pd.Index(self.tickers, name="ticker"), columns=pd.Index(self.tickers, name="ticker"))
+
+def portfolio_risk(portfolio_return: np.ndarray) -> dict:
+    """Annualized volatility, Value at Risk and Expected Shortfall of daily portfolio returns"""
+    tail_cutoff = np.quantile(portfolio_return, TAIL)
+    tail = portfolio_return[portfolio_return < tail_cutoff]
+
+    return {
+        'volatility': portfolio_return.std(ddof=1) * TRADING_DAYS ** 0.5,
+        'var': tail_cutoff * TRADING_DAYS ** 0.5,
+        'es': tail.mean() * TRADING_DAYS ** 0.5 if len(tail) else np.nan,
+    }
+
+def window_sums(values: np.ndarray, window: int) -> np.ndarray:
+    """Sums over the trailing window of each date, along the first axis, from cumulative sums so each date costs O(1).
+    The first window - 1 dates are NaN."""
+    sums = np.full(np.shape(values), np.nan)
+
+    if len(values) < window:
+        return sums
+
+    cumulative = np.cumsum(values, axis=0, dtype=float)
+    sums[window - 1] = cumulative[window - 1]
+    np.subtract(cumulative[window:], cumulative[:-window], out=sums[window:])
+
+    return sums
+
+def window_counts(present: np.ndarray, window: int) -> np.ndarray | int:
+    """Dates with a value in the trailing window of each date, just the window when there are no gaps"""
+    return window if present.all() else window_sums(present, window)
+
+def centered(values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Values less their mean and 0 where missing, so sums of squares don't lose precision"""
+    values = np.where(present, values, 0.0)
+    values -= values.sum(axis=0) / np.maximum(present.sum(axis=0), 1)
+    np.copyto(values, 0.0, where=~present)
+
+    return values
+
+def rolling_volatility(returns: np.ndarray, window: int) -> np.ndarray:
+    """Annualized volatility over the trailing window, for a series or each column of a matrix.
+    NaN unless every date in the window has a return. pandas updates the window sums as it moves, one pass over the dates."""
+    volatility = pd.DataFrame(returns).rolling(window).std().to_numpy() * TRADING_DAYS ** 0.5
+
+    return volatility.reshape(np.shape(returns))
+
+def ewma_volatility(returns: np.ndarray, decay: float = EWMA_DECAY) -> np.ndarray:
+    """Annualized RiskMetrics volatility: an exponentially weighted mean of squared returns, updated once per date"""
+    squared = pd.DataFrame(np.square(returns))
+
+    return np.sqrt(squared.ewm(alpha=1 - decay, adjust=False).mean().to_numpy() * TRADING_DAYS).reshape(np.shape(returns))
+
+def rolling_correlation(x: np.ndarray, y: np.ndarray, window: int) -> np.ndarray:
+    """Correlation over the trailing window of each column of x with the series y.
+    NaN unless both have a return on every date in the window."""
+    x = x.reshape(len(x), -1)
+    y = y.reshape(len(y), 1)
+    present = ~np.isnan(x) & ~np.isnan(y)
+    x = centered(x, present)
+    y = centered(np.broadcast_to(y, x.shape), present)
+
+    n = window_counts(present, window)
+    sum_x = window_sums(x, window)
+    sum_y = window_sums(y, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = window_sums(x * y, window) - sum_x * sum_y / n
+        variance_x = window_sums(np.square(x, out=x), window) - sum_x ** 2 / n
+        variance_y = window_sums(np.square(y, out=y), window) - sum_y ** 2 / n
+        correlation = covariance / np.sqrt(np.maximum(variance_x, 0) * np.maximum(variance_y, 0))
+
+    correlation[n < window] = np.nan
+
+    return np.clip(correlation, -1, 1)
+
+class RiskModel:
+    """Everything about a set of tickers that doesn't depend on the weights"""
+    def __init__(self, returns: Returns):
+        self.returns = returns
+        # Daily returns that each date's portfolio return is made of, one row per date
+        self.scenarios = np.ascontiguousarray(np.nan_to_num(returns.returns))
+        # Covariance of the scenarios, so the portfolio variance is w'Σw
+        self.covariance = np.atleast_2d(np.cov(self.scenarios, rowvar=False, ddof=1))
+        self.ticker_stats = returns.ticker_stats()
+        self.correlation = returns.correlation()
+
+    def risk(self, tickers_and_weights: dict) -> dict:
+        """Volatility, Value at Risk and Expected Shortfall for any weights on these tickers"""
+        weights = self.returns.weights(tickers_and_weights)
+        portfolio_return = self.scenarios @ weights
+
+        # Only the two scenarios around the quantile need to be in place, not a full sort
+        position = TAIL * (len(portfolio_return) - 1)
+        below = int(position)
+        above = min(below + 1, len(portfolio_return) - 1)
+        partitioned = np.partition(portfolio_return, [below, above])
+        tail_cutoff = partitioned[below] + (position - below) * (partitioned[above] - partitioned[below])
+        tail = partitioned[:above + 1]
+        tail = tail[tail < tail_cutoff]
+
+        return {
+            'volatility': (weights @ self.covariance @ weights * TRADING_DAYS) ** 0.5,
+            'var': tail_cutoff * TRADING_DAYS ** 0.5,
+            'es': tail.mean() * TRADING_DAYS ** 0.5 if len(tail) else np.nan,
+        }
+
+class ModelCache:
+    """Risk models by set of tickers, least recently used are dropped first.
+    A model is rebuilt when the prices it was built from changed (version) or after max_age seconds."""
+    def __init__(self, max_models: int, max_age: float):
+        self.max_models = max_models
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # tickers -> (model, version, built at)
+        self.models = OrderedDict()
+
+    def key(self, tickers) -> tuple:
+        return tuple(sorted(set(tickers)))
+
+    def get(self, tickers, version) -> RiskModel | None:
+        key = self.key(tickers)
+
+        with self.lock:
+            if key not in self.models:
+                return None
+
+            model, model_version, built_at = self.models[key]
+
+            if model_version != version or time.time() - built_at > self.max_age:
+                del self.models[key]
+                return None
+
+            self.models.move_to_end(key)
+
+            return model
+
+    def put(self, tickers, version, model: RiskModel) -> None:
+        with self.lock:
+            self.models[self.key(tickers)] = (model, version, time.time())
+
+            while len(self.models) > self.max_models:
+                self.models.popitem(last=False)
+
+def analyze(model: RiskModel, tickers_and_weights: dict) -> dict:
+    """Everything the page shows"""
+    dates = model.returns.dates.rename("date")
+    portfolio_return = model.scenarios @ model.returns.weights(tickers_and_weights)
+
+    rolling = {f"{window} days": rolling_volatility(portfolio_return, window) for window in ROLLING_WINDOWS}
+    rolling["EWMA"] = ewma_volatility(portfolio_return)
+
+    return {
+        'portfolio_return': pd.Series(portfolio_return, index=dates, name="weighted_return"),
+        'cumulative_return': pd.Series(np.cumprod(1 + portfolio_return) - 1, index=dates, name="weighted_return"),
+        **portfolio_risk(portfolio_return),
+        'return_vs_volatility': model.ticker_stats,
+        'correlation': model.correlation,
+        'rolling_volatility': pd.DataFrame(rolling, index=dates),
+        # Each ticker against the portfolio, which is linear in the number of tickers unlike every pair
+        'rolling_correlation': pd.DataFrame(rolling_correlation(model.returns.returns, portfolio_return, ROLLING_WINDOWS[1]), index=dates, columns=pd.Index(model.returns.tickers, name="ticker")),
+    }
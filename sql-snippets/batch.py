@@ -0,0 +1,130 @@
+# Batch runner for SQL Snippets.
+# Runs every stored snippet in parallel against a database file and records the time, row
+# count and a hash of the result of each. Compared against a previous run, it reports the
+# snippets that got slower, return different results or started failing, e.g. after a
+# schema change.
+#
+# Run this using `python3 batch.py northwind.db --output run.json` from the sql-snippets
+# directory, then `python3 batch.py northwind.db --baseline run.json` after the change.
+# Snippets are read from the app's object store, or from a JSON file with --snippets.
+from __future__ import annotations
+import argparse
+import datetime
+import hashlib
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import queries
+
+def load_snippets(path: str | None) -> list[dict]:
+    if path is not None:
+        with open(path) as f:
+            return json.load(f)
+
+    import pycob as cob
+    app = cob.App("SQL Snippets", use_built_in_auth=True)
+
+    return app.list_objects(table_id="snippet")
+
+def result_hash(df: pd.DataFrame) -> str:
+    """Changes when the column names or any value change, including row order"""
+    digest = hashlib.sha256(json.dumps([str(column) for column in df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df.astype(object), index=False).to_numpy().tobytes())
+
+    return digest.hexdigest()[:16]
+
+def run_snippet(pool: queries.ConnectionPool, snippet: dict, timeout: float, max_rows: int, repeat: int) -> dict:
+    """Runs a snippet `repeat` times and records the best time"""
+    run = {'id': snippet.get("id"), 'name': snippet.get("Name", ""), 'seconds': None, 'instructions': None, 'rows': None, 'truncated': False, 'hash': None, 'error': None}
+
+    try:
+        for _ in range(repeat):
+            stats = {}
+
+            with pool.connection() as conn:
+                df, truncated = queries.fetch_dataframe(conn, snippet.get("Query", ""), timeout=timeout, max_rows=max_rows, stats=stats)
+
+            if run['seconds'] is None or stats['seconds'] < run['seconds']:
+                run['seconds'] = round(stats['seconds'], 4)
+                run['instructions'] = stats['instructions']
+
+        run.update(rows=len(df), truncated=truncated, hash=result_hash(df))
+    except Exception as e:
+        run['error'] = str(e)
+
+    return run
+
+def run_all(database_path: str, snippets: list[dict], workers: int = 4, timeout: float = 60, max_rows: int = 1000000, repeat: int = 1) -> dict:
+    pool = queries.ConnectionPool(database_path, workers)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            runs = list(executor.map(lambda snippet: run_snippet(pool, snippet, timeout, max_rows, repeat), snippets))
+    finally:
+        pool.close()
+
+    return {'database': database_path, 'run_at': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'runs': runs}
+
+def compare(current: dict, baseline: dict, slowdown: float = 1.5, min_seconds: float = 0.05) -> list[str]:
+    """Regressions since the baseline run. A snippet counts as slower if it takes slowdown times as long, and at least min_seconds longer."""
+    previous = {run['id']: run for run in baseline['runs']}
+    regressions = []
+
+    for run in current['runs']:
+        before = previous.get(run['id'])
+        name = f"{run['name']} ({run['id']})"
+
+        if before is None:
+            continue
+
+        if run['error'] and not before['error']:
+            regressions.append(f"{name}: fails: {run['error']}")
+        elif run['error'] or before['error']:
+            continue
+        elif run['hash'] != before['hash']:
+            regressions.append(f"{name}: result changed, {before['rows']} -> {run['rows']} rows")
+
+        if run['seconds'] is not None and before['seconds'] is not None and run['seconds'] > before['seconds'] * slowdown and run['seconds'] - before['seconds'] >= min_seconds:
+            regressions.append(f"{name}: slower, {before['seconds']:.3f}s -> {run['seconds']:.3f}s")
+
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run every snippet against a database and compare with a previous run")
+    parser.add_argument("database", help="SQLite database file to run the snippets against")
+    parser.add_argument("--snippets", help="JSON file with a list of snippets, instead of the app's object store")
+    parser.add_argument("--baseline", help="JSON output of a previous run to compare with")
+    parser.add_argument("--output", help="Where to write the JSON output of this run")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a snippet is stopped")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per snippet, the best time is kept")
+    parser.add_argument("--slowdown", type=float, default=1.5, help="How many times slower counts as a regression")
+    args = parser.parse_args()
+
+    snippets = load_snippets(args.snippets)
+    current = run_all(args.database, snippets, args.workers, args.timeout, repeat=args.repeat)
+
+    for run in current['runs']:
+        status = f"error: {run['error']}" if run['error'] else f"{run['seconds']:8.3f}s {run['rows']:>8} rows {run['hash']}"
+        print(f"{run['name'][:40]:40} {status}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.slowdown)
+
+        print(f"\n{len(regressions)} regressions since the baseline")
+
+        for regression in regressions:
+            print(f"  {regression}")
+
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
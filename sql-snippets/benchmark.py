@@ -0,0 +1,128 @@
+# Benchmarks for SQL Snippets.
+# Run this using `python3 benchmark.py` from the sql-snippets directory.
+import os
+import sqlite3 as db
+import tempfile
+import threading
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import queries
+import batch
+import results
+
+# A mix of snippets like the ones users write against northwind.db
+SNIPPETS = [
+    "SELECT * FROM Orders",
+    "SELECT c.CompanyName, COUNT(*) AS orders FROM Orders o JOIN Customers c ON c.CustomerID = o.CustomerID GROUP BY c.CompanyName ORDER BY orders DESC",
+    "SELECT p.ProductName, SUM(d.UnitPrice * d.Quantity * (1 - d.Discount)) AS revenue FROM \"Order Details\" d JOIN Products p ON p.ProductID = d.ProductID GROUP BY p.ProductName ORDER BY revenue DESC",
+    "SELECT strftime('%Y-%m', o.OrderDate) AS month, COUNT(DISTINCT o.OrderID) AS orders, SUM(d.Quantity) AS units FROM Orders o JOIN \"Order Details\" d ON d.OrderID = o.OrderID GROUP BY month",
+    # Repeated column names (CustomerID)
+    "SELECT * FROM Orders o JOIN Customers c ON c.CustomerID = o.CustomerID",
+]
+
+def run_concurrently(run, concurrency: int, runs_per_thread: int) -> tuple[float, int]:
+    """Runs the snippets from `concurrency` threads at once. Returns the wall time and the number of failed runs."""
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(i: int) -> None:
+        nonlocal errors
+
+        for j in range(runs_per_thread):
+            try:
+                run(SNIPPETS[(i + j) % len(SNIPPETS)])
+            except Exception:
+                with lock:
+                    errors += 1
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+
+    return time.perf_counter() - start, errors
+
+def bench_concurrency(path: str = 'northwind.db', concurrency_levels: tuple = (1, 2, 4, 8, 16), runs_per_thread: int = 20) -> None:
+    # The original setup: one connection shared by every gunicorn thread
+    shared = db.connect(path, check_same_thread=False)
+    pool = queries.ConnectionPool(path, max(concurrency_levels))
+
+    # Warm up the page cache and each connection
+    run_concurrently(lambda sql: pd.read_sql_query(sql, shared), 1, len(SNIPPETS))
+    run_concurrently(lambda sql: pool.read_sql_query(sql), max(concurrency_levels), len(SNIPPETS))
+
+    print(f"Concurrent snippet runs against {path} ({runs_per_thread} runs per thread)")
+
+    for concurrency in concurrency_levels:
+        runs = concurrency * runs_per_thread
+        shared_elapsed, shared_errors = run_concurrently(lambda sql: pd.read_sql_query(sql, shared), concurrency, runs_per_thread)
+        pool_elapsed, pool_errors = run_concurrently(lambda sql: pool.read_sql_query(sql, timeout=30), concurrency, runs_per_thread)
+
+        print(f"  x{concurrency:<3} shared connection: {runs / shared_elapsed:7.1f} runs/s ({shared_errors} errors)"
+              f"   pool: {runs / pool_elapsed:7.1f} runs/s ({pool_errors} errors)")
+
+    pool.close()
+
+def bench_timeout(path: str = 'northwind.db', timeout: float = 1.0) -> None:
+    pool = queries.ConnectionPool(path, 1)
+    runaway = "WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter) SELECT COUNT(*) FROM counter"
+
+    # The time limit costs a Python call every PROGRESS_INSTRUCTIONS instructions
+    without_limit = min(timeit_once(lambda: pool.read_sql_query(SNIPPETS[3])) for _ in range(5))
+    with_limit = min(timeit_once(lambda: pool.read_sql_query(SNIPPETS[3], timeout=30)) for _ in range(5))
+
+    start = time.perf_counter()
+
+    try:
+        pool.read_sql_query(runaway, timeout=timeout)
+    except queries.QueryTimeout as e:
+        print(f"Runaway query stopped after {time.perf_counter() - start:.2f}s: {e}")
+
+    print(f"  time limit overhead: {without_limit * 1000:.2f} ms -> {with_limit * 1000:.2f} ms")
+
+    pool.close()
+
+def timeit_once(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def bench_batch(path: str = 'northwind.db', copies: int = 25, worker_counts: tuple = (1, 2, 4, 8)) -> None:
+    snippets = [{'id': str(i), 'Name': f"snippet {i}", 'Query': SNIPPETS[i % len(SNIPPETS)]} for i in range(copies * len(SNIPPETS))]
+
+    print(f"Batch run of {len(snippets)} snippets against {path}")
+
+    for workers in worker_counts:
+        start = time.perf_counter()
+        run = batch.run_all(path, snippets, workers)
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for snippet_run in run['runs'] if snippet_run['error'])
+
+        print(f"  x{workers}: {elapsed:6.2f}s ({errors} errors, {len(batch.compare(run, run))} regressions against itself)")
+
+def bench_results(path: str = 'northwind.db') -> None:
+    """Writes each snippet's result to a result file and reads the first page back"""
+    pool = queries.ConnectionPool(path, 1)
+    directory = tempfile.mkdtemp()
+
+    print(f"Result files for {len(SNIPPETS)} snippets")
+
+    for i, sql in enumerate(SNIPPETS):
+        df = pool.read_sql_query(sql)
+        result_path = os.path.join(directory, f"{i}.arrow")
+        write = timeit_once(lambda: results.write_result(result_path, df))
+        read = timeit_once(lambda: results.read_page(result_path, 1, 100))
+
+        assert list(results.read_page(result_path, 1, 100).columns) == list(df.columns)
+        assert results.read_info(result_path)['row_count'] == len(df)
+
+        print(f"  snippet {i}: {len(df):>6} rows x {len(df.columns):>2} columns, write {write * 1000:6.2f} ms, first page {read * 1000:6.2f} ms")
+
+    pool.close()
+
+if __name__ == "__main__":
+    bench_concurrency()
+    bench_timeout()
+    bench_batch()
+    bench_results()
@@ -0,0 +1,141 @@
+# Result cache for SQL Snippets.
+# Results are cached on local disk as result files (see results.py), keyed by the normalized SQL and a version token of
+# the database, so the same query is only run once per version of the data, whichever
+# snippet runs it, and a result is never served after the data it came from changed.
+# Entries expire after a TTL, and the least recently used ones are evicted to keep the
+# cache under a size limit.
+from __future__ import annotations
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+import results
+
+# String literals, quoted identifiers and comments, which are left as is or removed when normalizing
+SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?(?:\*/|$))""", re.DOTALL)
+
+def normalize_sql(sql: str) -> str:
+    """Removes comments, collapses whitespace and lowercases everything outside quotes and literals,
+    so queries that only differ in formatting share a cache entry"""
+    # Comments become whitespace, then everything between literals is normalized
+    without_comments = "".join(" " if part.startswith(("--", "/*")) else part for part in SQL_TOKENS.split(sql))
+    parts = SQL_TOKENS.split(without_comments)
+
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i]).lower()
+
+    return "".join(parts).strip().rstrip(";").strip()
+
+def database_version(path: str) -> str:
+    """Changes whenever the database is written to.
+    PRAGMA data_version only changes for other connections' writes and can't be compared across connections,
+    so the modification time and size of the database and its write-ahead log are used instead, with the file change
+    counter from the database header for writes that land within the same modification time."""
+    version = []
+
+    for file in (path, path + "-wal"):
+        try:
+            stat = os.stat(file)
+            version.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+        except FileNotFoundError:
+            version.append("-")
+
+    try:
+        with open(path, "rb") as f:
+            f.seek(24)
+            version.append(f.read(4).hex())
+    except FileNotFoundError:
+        pass
+
+    return "/".join(version)
+
+class ResultCache:
+    def __init__(self, directory: str, max_bytes: int = 500 * 1024 * 1024, ttl: float = 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (size in bytes, time stored), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Pick up the entries left by the previous run, oldest first
+        files = []
+
+        for name in os.listdir(directory):
+            if name.endswith(".arrow"):
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name[:-len(".arrow")], stat.st_size))
+
+        for stored_at, key, size in sorted(files):
+            self.entries[key] = (size, stored_at)
+            self.size += size
+
+    def key(self, sql: str, version: str) -> str:
+        return hashlib.sha256(f"{normalize_sql(sql)}\0{version}".encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def get(self, sql: str, version: str) -> str | None:
+        return self.load(self.key(sql, version))
+
+    def put(self, sql: str, version: str, df: pd.DataFrame, truncated: bool = False) -> str:
+        key = self.key(sql, version)
+        self.store(key, df, truncated)
+
+        return key
+
+    def load(self, key: str) -> str | None:
+        """Returns the path of the cached result file, or None"""
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            size, stored_at = self.entries[key]
+
+            if time.time() - stored_at > self.ttl:
+                self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+
+            if not os.path.exists(self.path(key)):
+                # Removed by another process sharing the directory
+                self._remove(key)
+                return None
+
+        return self.path(key)
+
+    def store(self, key: str, df: pd.DataFrame, truncated: bool = False) -> None:
+        results.write_result(self.path(key), df, truncated)
+        size = os.path.getsize(self.path(key))
+
+        if size > self.max_bytes:
+            os.remove(self.path(key))
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries[key][0]
+
+            self.entries[key] = (size, time.time())
+            self.size += size
+
+            # Evict the least recently used entries
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str) -> None:
+        size, stored_at = self.entries.pop(key)
+        self.size -= size
+
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,190 @@
+# Table usage and per-table versions for SQL Snippets.
+# The tables and columns a query reads are taken from SQLite itself: preparing the query
+# with an authorizer installed reports every column it reads, through views, CTEs and
+# subqueries, without a SQL parser.
+# A result is valid for as long as the tables it read are unchanged, so a write to one
+# table only invalidates the results of the snippets that read it.
+# A table's version is its checksum as of a version of the database file. Until a table
+# is checksummed again after a write, its version changes with every write, so a result
+# is never served from before an UPDATE. Checksums run in the background, off the
+# request path, and are kept in a file across restarts.
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sqlite3 as db
+import threading
+import traceback
+import zlib
+import cache
+
+def table_usage(conn: db.Connection, sql: str) -> dict[str, list[str]]:
+    """The tables a query reads, with the columns it reads from each ("" for none, e.g. COUNT(*))"""
+    usage = {}
+
+    def authorize(action, table, column, database, trigger_or_view) -> int:
+        if action == db.SQLITE_READ and table and not table.startswith("sqlite_"):
+            usage.setdefault(table, set()).add(column or "")
+
+        return db.SQLITE_OK
+
+    conn.set_authorizer(authorize)
+
+    try:
+        # Preparing the statement is enough, EXPLAIN doesn't run it
+        conn.execute(f"EXPLAIN {sql}").close()
+    finally:
+        conn.set_authorizer(None)
+
+    # Reading a view also reports the tables underneath it, which are what can change
+    views = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'view'")}
+
+    return {table: sorted(columns) for table, columns in usage.items() if table not in views}
+
+def row_checksum(*values) -> int:
+    return zlib.crc32(repr(values).encode())
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def table_checksum(conn: db.Connection, table: str) -> str:
+    """Changes when rows are inserted, updated or deleted, or the table's schema changes. Reads the whole table."""
+    conn.create_function("row_checksum", -1, row_checksum, deterministic=True)
+
+    columns = [row[1] for row in conn.execute("SELECT * FROM pragma_table_info(?)", (table,))]
+    quoted = ", ".join('"' + column.replace('"', '""') + '"' for column in columns)
+    schema = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+
+    # The sum of the row checksums doesn't depend on the order rows are read in
+    count, total = conn.execute(f'SELECT COUNT(*), TOTAL(row_checksum({quoted})) FROM {quote_identifier(table)}').fetchone()
+
+    return hashlib.sha1(f"{schema}:{count}:{total}".encode()).hexdigest()[:16]
+
+class TableVersions:
+    """Versions of individual tables, read on the request path without querying the database.
+    After a write, the tables asked for get a version that changes with every write until the background check has
+    checksummed them again. Those with the same checksum get their old version back, the others a new one, and
+    on_change(table) is called for them."""
+    def __init__(self, path: str, pool, state_path: str, on_change=None, check_every: float = 60):
+        self.path = path
+        self.pool = pool
+        self.state_path = state_path
+        self.on_change = on_change
+        # Only guards the dict below, queries run without it
+        self.lock = threading.Lock()
+        # table -> (checksum, database version it was taken at), None for tables not checksummed yet
+        self.checksums = self.load()
+        # Checks run when a table was asked for after a write, and at least every check_every seconds
+        self.check_every = check_every
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def version(self, tables: list[str]) -> str:
+        """A token that changes when any of the tables changes. With no tables, the version of the whole database."""
+        database_version = cache.database_version(self.path)
+
+        if not tables:
+            return database_version
+
+        versions = {}
+
+        with self.lock:
+            for table in set(tables):
+                checksum, checked_version = self.checksums.setdefault(table, None) or (None, None)
+
+                if checked_version == database_version:
+                    versions[table] = checksum
+                else:
+                    # Not checksummed since the last write, so it may have changed
+                    versions[table] = f"unchecked.{database_version}"
+                    self.wake.set()
+
+        return ";".join(f"{table}={versions[table]}" for table in sorted(versions))
+
+    def checksum(self, conn: db.Connection, table: str) -> str:
+        try:
+            return table_checksum(conn, table)
+        except db.Error:
+            # Dropped since the query was saved
+            return "missing"
+
+    def load(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                return {table: tuple(state) if state else None for table, state in json.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        with self.lock:
+            state = dict(self.checksums)
+
+        # Write to a temporary file first so a restart never reads a partial file
+        temporary = f"{self.state_path}.{os.getpid()}.tmp"
+
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+
+        os.replace(temporary, self.state_path)
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, name="table-checksums", daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wake.set()
+
+    def loop(self) -> None:
+        while True:
+            self.wake.wait(self.check_every)
+            self.wake.clear()
+
+            if self.stop_event.is_set():
+                return
+
+            try:
+                self.check()
+            except Exception:
+                traceback.print_exc()
+
+    def check(self) -> None:
+        """Checksums the tables written to since their last checksum"""
+        with self.lock:
+            tables = list(self.checksums)
+
+        changed = []
+        checked = False
+
+        for table in tables:
+            database_version = cache.database_version(self.path)
+
+            with self.lock:
+                checksum, checked_version = self.checksums.get(table) or (None, None)
+
+            if checked_version == database_version:
+                continue
+
+            with self.pool.connection() as conn:
+                new_checksum = self.checksum(conn, table)
+
+            # A write while it ran may be partly in the checksum, it is checked again at the next version
+            if cache.database_version(self.path) != database_version:
+                continue
+
+            with self.lock:
+                self.checksums[table] = (new_checksum, database_version)
+
+            checked = True
+
+            if checksum is not None and checksum != new_checksum:
+                changed.append(table)
+
+        if checked:
+            self.save()
+
+        if self.on_change is not None:
+            for table in changed:
+                self.on_change(table)
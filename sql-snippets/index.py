@@ -0,0 +1,74 @@
+# Snippet index for SQL Snippets.
+# One small record per snippet, holding the few fields the snippet listing shows. The records
+# are kept up to date when snippets are created, updated, run and deleted, so listing and
+# searching snippets doesn't load every snippet with its full query. A change only writes
+# the record of its own snippet, so gunicorn workers can't overwrite each other's changes.
+# It also answers which snippets read a table, from the tables extracted from their queries.
+from __future__ import annotations
+
+# Fields of a snippet kept in the index
+INDEX_FIELDS = ["id", "Name", "Tables", "author", "last_run", "rows_returned", "tables_used"]
+
+class SnippetIndex:
+    def __init__(self, table_id: str = "snippet_index"):
+        self.table_id = table_id
+
+    def load(self, store) -> dict:
+        """snippet id -> index entry. Read from the store every time, so changes made by other workers are seen.
+        store is the server request or the app"""
+        try:
+            entries = {entry["id"]: entry for entry in store.list_objects(table_id=self.table_id) if entry and "id" in entry}
+        except:
+            entries = {}
+
+        if not entries:
+            # First use: build the index from the snippets once
+            entries = {snippet["id"]: self.entry(snippet) for snippet in store.list_objects(table_id="snippet") if snippet and "id" in snippet}
+
+            for snippet_id, entry in entries.items():
+                store.store_dict(table_id=self.table_id, object_id=snippet_id, value=entry)
+
+        return entries
+
+    def entry(self, snippet: dict) -> dict:
+        return {field: snippet.get(field, "") for field in INDEX_FIELDS}
+
+    def update(self, store, snippet: dict) -> None:
+        store.store_dict(table_id=self.table_id, object_id=snippet["id"], value=self.entry(snippet))
+
+    def remove(self, store, snippet_id: str) -> None:
+        store.delete_dict(table_id=self.table_id, object_id=snippet_id)
+
+    def tables(self, entry: dict) -> set:
+        """Lowercase names of the tables the snippet reads, or that its author listed for snippets saved before tables were extracted"""
+        if entry.get("tables_used"):
+            return {table.lower() for table in entry["tables_used"]}
+
+        return {table.strip().lower() for table in str(entry.get("Tables") or "").split(",") if table.strip()}
+
+    def snippets_using(self, store, table: str) -> list[str]:
+        return [snippet_id for snippet_id, entry in self.load(store).items() if table.lower() in self.tables(entry)]
+
+    def search(self, store, query: str = "", table: str = "", author: str = "", page_number: int = 1, page_size: int = 50) -> tuple[list[dict], int]:
+        """Snippets whose name, tables or author contain query, filtered by table and author (case-insensitive).
+        Returns one page of them, most recently run first, and how many matched."""
+        query, table, author = query.strip().lower(), table.strip().lower(), author.strip().lower()
+
+        matches = []
+
+        for entry in self.load(store).values():
+            name, tables, entry_author = (str(entry.get(field) or "").lower() for field in ("Name", "Tables", "author"))
+
+            if query and query not in name and query not in tables and query not in entry_author:
+                continue
+            if table and table not in self.tables(entry):
+                continue
+            if author and author != entry_author:
+                continue
+
+            matches.append(entry)
+
+        matches.sort(key=lambda entry: (str(entry.get("last_run") or ""), str(entry.get("Name") or "")), reverse=True)
+        start = (page_number - 1) * page_size
+
+        return matches[start:start + page_size], len(matches)
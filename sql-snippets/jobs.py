@@ -0,0 +1,134 @@
+# Background jobs for SQL Snippets.
+# Snippet runs are queued and run on a bounded pool of background threads instead of a
+# gunicorn request thread, so slow queries can't use up the request threads. Pages start
+# a job, then poll its status by job id and can cancel it.
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobCancelled(Exception):
+    pass
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = "queued"
+        self.message = ""
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.cancel_callbacks = []
+        self.lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancel_event.set()
+            callbacks = list(self.cancel_callbacks)
+
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback) -> None:
+        """Calls callback when the job is cancelled, e.g. to interrupt a running query. Called right away if it already was."""
+        with self.lock:
+            if not self.cancel_event.is_set():
+                self.cancel_callbacks.append(callback)
+                return
+
+        callback()
+
+    def remove_on_cancel(self, callback) -> None:
+        with self.lock:
+            if callback in self.cancel_callbacks:
+                self.cancel_callbacks.remove(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "cancelled", "failed")
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0
+
+        return (self.finished_at or time.time()) - self.started_at
+
+class JobRunner:
+    """Runs jobs on a bounded pool of background threads and remembers the most recent ones.
+    At most max_pending jobs can be waiting or running at once."""
+    def __init__(self, max_workers: int = 1, max_pending: int = 100, max_jobs: int = 1000):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, name: str, fn) -> Job:
+        """Runs fn(job) in the background and returns the job right away"""
+        job = Job(name)
+
+        with self.lock:
+            if sum(1 for old in self.jobs.values() if not old.finished) >= self.max_pending:
+                raise JobQueueFull(f"{self.max_pending} jobs are already waiting to run")
+
+            self.jobs[job.id] = job
+
+            # Forget the oldest finished jobs
+            for job_id in [job_id for job_id, old in self.jobs.items() if old.finished][:max(0, len(self.jobs) - self.max_jobs)]:
+                del self.jobs[job_id]
+
+        self.executor.submit(self._run, job, fn)
+
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def active(self, name: str) -> Job | None:
+        """The queued or running job with this name, if any"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.name == name and not job.finished:
+                    return job
+
+        return None
+
+    def _run(self, job: Job, fn) -> None:
+        job.started_at = time.time()
+        job.status = "running"
+
+        try:
+            job.check_cancelled()
+            fn(job)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            # A cancelled job fails with whatever error stopping it caused
+            if not job.cancelled:
+                traceback.print_exc()
+
+            job.error = str(e)
+            job.status = "cancelled" if job.cancelled else "failed"
+        finally:
+            job.finished_at = time.time()
@@ -1,16 +1,250 @@
 # To use pycob, make sure to run `pip install pycob` in your terminal.
 import pycob as cob
 import pandas as pd
+import plotly.express as px
 import datetime
 import uuid
+import os
+from urllib.parse import urlencode
 import sqlite3 as db
+import queries
+import cache
+import results
+import jobs
+import scheduler
+import dependencies
+from index import SnippetIndex, INDEX_FIELDS
 
 # List of admin usernames.
 # TODO: Change this to the list of usernames of your admins.
 admin_users = ["admin"]
 
 # HELPER FUNCTIONS
-conn = db.connect('northwind.db', check_same_thread=False)
+database_path = 'northwind.db'
+
+# Snippets run on a pool of read-only connections, one per gunicorn thread (see Procfile)
+pool_size = 8
+
+# Queries running longer than this many seconds are stopped
+query_timeout = 30
+
+# Results are cut off at this many rows or about this many bytes
+max_result_rows = 100000
+max_result_bytes = 50 * 1024 * 1024
+
+# Rows shown per page of results
+page_size = 100
+
+pool = queries.ConnectionPool(database_path, pool_size)
+
+# Results are cached on local disk for an hour, up to 500 MB
+result_cache = cache.ResultCache("result_cache", max_bytes=500 * 1024 * 1024, ttl=3600)
+
+# The result of the last run of each snippet is kept here as an Arrow file
+results_directory = "results"
+os.makedirs(results_directory, exist_ok=True)
+
+def result_path(id: str) -> str:
+    return os.path.join(results_directory, f"{os.path.basename(id)}.arrow")
+
+def load_results(id: str, data: dict) -> str | None:
+    """The result file of the last run of the snippet, or None if a table it read changed since"""
+    if data.get("result_version") == table_versions.version(data.get("result_tables", [])) and os.path.exists(result_path(id)):
+        return result_path(id)
+
+    # The same query may have been run against the current data by another snippet
+    return result_cache.get(data.get("Query", ""), result_version(data.get("Query", "")))
+
+def add_results(page: cob.Page, path: str, id: str, page_number: int = 1) -> None:
+    """Adds one page of results with links to the previous and next pages"""
+    info = results.read_info(path)
+    pages = queries.page_count(info['row_count'], page_size)
+    page_number = min(max(1, page_number), pages)
+
+    if info['truncated']:
+        page.add_alert(f"Only the first {info['row_count']} rows were kept. Add a WHERE or LIMIT clause to see the rest.", "Result truncated", "yellow")
+
+    page.add_text(f"{info['row_count']} rows, page {page_number} of {pages}")
+    page.add_datagrid(results.read_page(path, page_number, page_size))
+
+    if page_number > 1:
+        page.add_link("Previous page", f"/snippet_results?id={id}&page={page_number - 1}")
+    if page_number < pages:
+        page.add_link("Next page", f"/snippet_results?id={id}&page={page_number + 1}")
+
+# Name, tables, author and last run of every snippet, for the listing page
+snippet_index = SnippetIndex()
+
+# Snippets shown per page of the listing
+snippets_page_size = 50
+
+def tables_used(sql: str) -> dict[str, list[str]]:
+    """The tables the query reads and the columns it reads from them, or {} if it isn't valid SQL"""
+    try:
+        with pool.connection() as conn:
+            return dependencies.table_usage(conn, sql)
+    except db.Error:
+        return {}
+
+def result_version(sql: str) -> str:
+    """Changes when any table the query reads changes"""
+    return table_versions.version(list(tables_used(sql)))
+
+def invalidate_table(table: str) -> None:
+    """Drops the stored results of exactly the snippets that read a table that changed"""
+    for id in snippet_index.snippets_using(app, table):
+        if os.path.exists(result_path(id)):
+            os.remove(result_path(id))
+
+# Versions of the tables, checked when a result is about to be shown. Checksums run in the background after a write
+# and are kept in table_checksums.json across restarts.
+table_versions = dependencies.TableVersions(database_path, pool, "table_checksums.json", on_change=invalidate_table)
+
+def add_table_usage(data: dict) -> None:
+    """Stores the tables and columns the snippet's query reads, filling in Tables if the author left it empty"""
+    usage = tables_used(data.get("Query", ""))
+
+    data["tables_used"] = list(usage)
+    data["columns_used"] = usage
+
+    if not data.get("Tables"):
+        data["Tables"] = ", ".join(usage)
+
+# Runs kept in each snippet's history
+max_history = 50
+
+def add_run_stats(page: cob.Page, run: dict) -> None:
+    """Adds the timing and query plan of a run, flagging table scans an index could avoid"""
+    page.add_text(f"{run['seconds']:.3f}s, {run['rows_returned']} rows, {run['result_bytes'] / 1024:.1f} KB, {run['instructions']} instructions")
+
+    if run['full_scans']:
+        page.add_alert(f"Full scan of {', '.join(run['full_scans'])}. An index on the columns used to filter, join or sort could avoid it.", "Full table scan", "yellow")
+
+    if run['query_plan']:
+        page.add_code("\n".join(run['query_plan']))
+
+def record_run(store, id: str, run: dict) -> None:
+    """Appends a run to the snippet's history, kept apart from the snippet so listing snippets doesn't load it.
+    store is the server request, or the app for runs that finish in the background."""
+    history = load_history(store, id)
+    history.append(run)
+
+    store.store_dict(table_id="snippet_history", object_id=id, value={"runs": history[-max_history:]})
+
+def load_history(store, id: str) -> list:
+    try:
+        return (store.retrieve_dict(table_id="snippet_history", object_id=id) or {}).get("runs", [])
+    except:
+        return []
+
+def save_run(store, id: str, code: str, version: str, stats: dict, cached: bool) -> dict:
+    """Records a run whose result was written to result_path(id) and returns it"""
+    try:
+        plan = pool.explain(code)
+    except db.Error:
+        # e.g. several statements
+        plan = []
+
+    run = {
+        'run_at': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'seconds': round(stats['seconds'], 4),
+        'instructions': stats['instructions'],
+        'rows_returned': results.read_info(result_path(id))['row_count'],
+        'result_bytes': os.path.getsize(result_path(id)),
+        'cached': cached,
+        'full_scans': queries.avoidable_scans(code, plan),
+        'query_plan': plan,
+    }
+
+    record_run(store, id, run)
+
+    data = store.retrieve_dict(table_id="snippet", object_id=id)
+
+    data["last_run"] = run['run_at']
+    data["rows_returned"] = run['rows_returned']
+    data["last_run_seconds"] = run['seconds']
+    data["result_bytes"] = run['result_bytes']
+    data["full_scans"] = ", ".join(run['full_scans'])
+    data["result_version"] = version
+    data["result_tables"] = list(tables_used(code))
+
+    store.store_dict(table_id="snippet", object_id=id, value=data)
+    snippet_index.update(store, data)
+
+    return run
+
+# Snippet runs are queued and run by this many background threads, leaving the other
+# gunicorn threads free to serve pages. Runs beyond max_queued_runs are turned away.
+query_workers = 4
+max_queued_runs = 32
+
+snippet_jobs = jobs.JobRunner(max_workers=query_workers, max_pending=max_queued_runs)
+
+def run_snippet_job(job: jobs.Job, code: str, id: str, version: str) -> None:
+    stats = {'seconds': 0, 'instructions': 0}
+
+    with pool.connection() as conn:
+        # Cancelling the job stops the query where it is
+        interrupt = conn.interrupt
+        job.on_cancel(interrupt)
+
+        try:
+            job.check_cancelled()
+            df, truncated = queries.fetch_dataframe(conn, code, timeout=query_timeout, max_rows=max_result_rows, max_bytes=max_result_bytes, stats=stats)
+        finally:
+            job.remove_on_cancel(interrupt)
+
+    job.check_cancelled()
+
+    results.write_result(result_path(id), df, truncated)
+    result_cache.put(code, version, df, truncated)
+
+    job.result = save_run(app, id, code, version, stats, cached=False)
+
+def run_scheduled_snippet(id: str) -> None:
+    """Refreshes the stored result of a scheduled snippet, unless it is already up to date"""
+    data = app.retrieve_dict(table_id="snippet", object_id=id)
+
+    if not data or not data.get("Query"):
+        return
+
+    if load_results(id, data) == result_path(id):
+        return
+
+    version = result_version(data["Query"])
+    cached = result_cache.get(data["Query"], version)
+
+    if cached is not None:
+        try:
+            results.copy_result(cached, result_path(id))
+            save_run(app, id, data["Query"], version, {'seconds': 0, 'instructions': 0}, cached=True)
+            return
+        except FileNotFoundError:
+            # Evicted from the cache in the meantime, run the query instead
+            pass
+
+    if snippet_jobs.active(f"snippet {id}") is None:
+        try:
+            snippet_jobs.submit(f"snippet {id}", lambda job: run_snippet_job(job, data["Query"], id, version))
+        except jobs.JobQueueFull:
+            # Viewers' runs come first, it runs at the next check
+            pass
+
+# Scheduled snippets are re-run in the background, see scheduler.py
+snippet_scheduler = scheduler.Scheduler(run_scheduled_snippet)
+
+def set_schedule(store, id: str, schedule: str | None) -> None:
+    snippet_scheduler.set(id, schedule)
+    store.store_dict(table_id="snippet_schedule", object_id="schedules", value={"schedules": snippet_scheduler.scheduled()})
+
+def load_schedules(store) -> None:
+    try:
+        schedules = (store.retrieve_dict(table_id="snippet_schedule", object_id="schedules") or {}).get("schedules", {})
+    except:
+        schedules = {}
+
+    for id, schedule in schedules.items():
+        snippet_scheduler.set(id, schedule)
 
 # PAGE FUNCTIONS
 # Each page function takes in a server_request object and returns a page object.
@@ -37,9 +271,13 @@ def create_snippet(server_request: cob.Request) -> cob.Page:
         form_data["id"] = str(uuid.uuid4())
         form_data["last_run"] = ""
         form_data["rows_returned"] = 0
+        form_data["Refresh"] = form_data.get("Refresh", "Never")
+        add_table_usage(form_data)
 
         # Insert the new row into the database.
         server_request.store_dict(table_id="snippet", object_id=form_data["id"], value=form_data)
+        snippet_index.update(server_request, form_data)
+        set_schedule(server_request, form_data["id"], form_data["Refresh"])
 
         with page.add_card() as card:
             card.add_header("Success!")
@@ -54,9 +292,11 @@ def create_snippet(server_request: cob.Request) -> cob.Page:
             if username is not None and username != "": # Logged in users can write to this column
                 form.add_formtext("Query Name", "Name", placeholder="Descriptive Name for this Query")
             if username is not None and username != "": # Logged in users can write to this column
-                form.add_formtext("Tables Used", "Tables", placeholder="Table1, Table2")
+                form.add_formtext("Tables Used", "Tables", placeholder="Filled in from the query if left empty")
             if username is not None and username != "": # Logged in users can write to this column
                 form.add_formtextarea("Query", "Query", placeholder="SELECT *\nFROM Table1\nWHERE ...")
+            if username is not None and username != "": # Logged in users can write to this column
+                form.add_formselect("Refresh Results", "Refresh", options=list(scheduler.SCHEDULES), value="Never")
 
             form.add_formsubmit("Create")
     
@@ -78,7 +318,11 @@ def update_snippet(server_request: cob.Request) -> cob.Page:
         data["Query"] = form_data["Query"]
         data["Name"] = form_data["Name"]
         data["Tables"] = form_data["Tables"]        
+        data["Refresh"] = form_data.get("Refresh", data.get("Refresh", "Never"))
+        add_table_usage(data)
         server_request.store_dict(table_id="snippet", object_id=snippet_id, value=data)
+        snippet_index.update(server_request, data)
+        set_schedule(server_request, snippet_id, data["Refresh"])
         with page.add_card() as card:
             card.add_header("Success!")
             card.add_text("Your row has been updated.")
@@ -97,6 +341,8 @@ def update_snippet(server_request: cob.Request) -> cob.Page:
                 form.add_formtext("Tables", "Tables", value=data["Tables"] if "Tables" in data else "")
             if username == data['author']: # Only the author can update this column
                 form.add_formtextarea("Query", "Query", value=data["Query"] if "Query" in data else "")
+            if username == data['author']: # Only the author can update this column
+                form.add_formselect("Refresh Results", "Refresh", options=list(scheduler.SCHEDULES), value=data.get("Refresh", "Never"))
     
             form.add_formsubmit("Update")
         
@@ -114,6 +360,8 @@ def delete_snippet(server_request: cob.Request) -> cob.Page:
     if username is not None and username == data["author"]:
         if server_request.params("confirm") == "true":
             server_request.delete_dict(table_id="snippet", object_id=snippet_id)
+            snippet_index.remove(server_request, snippet_id)
+            set_schedule(server_request, snippet_id, None)
             with page.add_card() as card:
                 card.add_alert("Deleted", "Success", "green")
                 card.add_link("Home", "/")
@@ -180,13 +428,24 @@ def view_snippet(server_request: cob.Request) -> cob.Page:
     </form>
     """)
 
-    try:
-        df = server_request.app.from_cloud_pickle(f"{id}.pkl")
+    path = load_results(id, data)
+
+    if path is not None:
         page.add_header("Cached Results")
-        page.add_datagrid(df)
-    except:
+        add_results(page, path, id)
+    else:
         page.add_text("No cached results found. Run the SQL to see the results.")
 
+    history = load_history(server_request, id)
+
+    if history:
+        page.add_header("Run History")
+        add_run_stats(page, history[-1])
+
+        runs = pd.DataFrame(history)
+        fig = px.line(runs, x="run_at", y="seconds", hover_data=["rows_returned", "result_bytes", "cached"], markers=True, title="Run time (s)")
+        page.add_plotlyfigure(fig)
+
     return page   
 
 def run_snippet(server_request: cob.Request) -> cob.Page:
@@ -197,18 +456,92 @@ def run_snippet(server_request: cob.Request) -> cob.Page:
 
     page.add_codeeditor(code, language="sql")
 
-    df = pd.read_sql_query(code, conn)
+    # Repeat runs of a query against the same data are served from the cache
+    version = result_version(code)
+    cached = result_cache.get(code, version)
+
+    if cached is not None:
+        try:
+            results.copy_result(cached, result_path(id))
+        except FileNotFoundError:
+            # Evicted from the cache in the meantime, run the query instead
+            cached = None
+
+    if cached is not None:
+        page.add_text("Served from the result cache, the data hasn't changed since this query was last run")
+
+        run = save_run(server_request, id, code, version, {'seconds': 0, 'instructions': 0}, cached=True)
+        add_run_stats(page, run)
+        add_results(page, result_path(id), id)
+
+        return page
+
+    # Anything else runs in the background, this page follows it
+    try:
+        job = snippet_jobs.submit(f"snippet {id}", lambda job: run_snippet_job(job, code, id, version))
+    except jobs.JobQueueFull:
+        page.add_alert("Too many snippets are running right now. Try again in a moment.", "Busy", "yellow")
+        return page
+
+    page.add_html(f'<meta http-equiv="refresh" content="0; url=/snippet_job?job_id={job.id}&id={id}">')
+    page.add_link("See progress", f"/snippet_job?job_id={job.id}&id={id}")
+
+    return page
+
+def snippet_job(server_request: cob.Request) -> cob.Page:
+    page = cob.Page("Snippet")
+
+    id = server_request.params("id")
+    job = snippet_jobs.get(server_request.params("job_id"))
+
+    if job is None:
+        page.add_alert("This run is no longer tracked. Run the SQL again.", "Not found", "red")
+        return page
+
+    if server_request.params("cancel") == "true":
+        job.cancel()
 
-    server_request.app.to_cloud_pickle(df, f"{id}.pkl")
+    if not job.finished:
+        # Check again every second until the run finishes
+        page.add_html('<meta http-equiv="refresh" content="1">')
+        page.add_text(f"Query {job.status}, {job.elapsed:.1f}s")
 
-    page.add_datagrid(df)
+        with page.add_form(action="/snippet_job") as form:
+            form.add_formhidden("job_id", job.id)
+            form.add_formhidden("id", id)
+            form.add_formhidden("cancel", "true")
+            form.add_formsubmit("Cancel")
+
+        return page
+
+    if job.status == "done":
+        add_run_stats(page, job.result)
+        add_results(page, result_path(id), id)
+    elif job.status == "cancelled":
+        page.add_alert("The query was cancelled", "Cancelled", "yellow")
+    else:
+        page.add_alert(job.error, "Error", "red")
+
+    return page
+
+def snippet_results(server_request: cob.Request) -> cob.Page:
+    page = cob.Page("Results")
+
+    id = server_request.params("id")
+
+    try:
+        page_number = int(server_request.params("page") or 1)
+    except ValueError:
+        page_number = 1
 
     data = server_request.retrieve_dict(table_id="snippet", object_id=id)
+    path = load_results(id, data)
 
-    data["last_run"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data["rows_returned"] = len(df)
+    if path is None:
+        page.add_text("No cached results found. Run the SQL to see the results.")
+        return page
 
-    server_request.store_dict(table_id="snippet", object_id=id, value=data)
+    add_results(page, path, id, page_number)
 
     return page
 
@@ -218,15 +551,41 @@ def all_snippets(server_request: cob.Request) -> cob.Page:
     
     username = server_request.get_username()
 
-    snippets = server_request.list_objects(table_id="snippet")
+    query = server_request.params("q") or ""
+    table = server_request.params("table") or ""
+    author = server_request.params("author") or ""
+
+    try:
+        page_number = max(1, int(server_request.params("page") or 1))
+    except ValueError:
+        page_number = 1
+
+    with page.add_card() as card:
+        with card.add_form(action="/all_snippets") as form:
+            form.add_formtext("Search", "q", placeholder="Name, table or author", value=query)
+            form.add_formtext("Table", "table", placeholder="Orders", value=table)
+            form.add_formtext("Author", "author", value=author)
+            form.add_formsubmit("Search")
+
+    # Only the index is read, not the snippets themselves
+    snippets, total = snippet_index.search(server_request, query, table, author, page_number, snippets_page_size)
+    pages = queries.page_count(total, snippets_page_size)
 
-    df = pd.DataFrame(snippets)
+    df = pd.DataFrame(snippets, columns=INDEX_FIELDS)
 
     action_buttons = [
         cob.Rowaction(label="View", url="/view_snippet?id={id}", open_in_new_window=False),
     ]
 
-    page.add_pandastable(df, hide_fields=["id", "Query"], action_buttons=action_buttons)
+    page.add_text(f"{total} snippets, page {min(page_number, pages)} of {pages}")
+    page.add_pandastable(df, hide_fields=["id", "tables_used"], action_buttons=action_buttons)
+
+    filters = urlencode({"q": query, "table": table, "author": author})
+
+    if page_number > 1:
+        page.add_link("Previous page", f"/all_snippets?{filters}&page={page_number - 1}")
+    if page_number < pages:
+        page.add_link("Next page", f"/all_snippets?{filters}&page={page_number + 1}")
 
     return page           
     
@@ -238,6 +597,12 @@ app.register_function(update_snippet, require_login=True, show_in_navbar=False,
 app.register_function(delete_snippet, require_login=True, show_in_navbar=False, footer_category=None)
 app.register_function(view_snippet, show_in_navbar=False, footer_category=None)
 app.register_function(run_snippet, show_in_navbar=False, footer_category=None)
+app.register_function(snippet_results, show_in_navbar=False, footer_category=None)
+app.register_function(snippet_job, show_in_navbar=False, footer_category=None)
+
+load_schedules(app)
+snippet_scheduler.start()
+table_versions.start()
 
 server = app.run()
 # Run this using `python3 main.py` or `python main.py` depending on your system.
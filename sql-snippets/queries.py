@@ -0,0 +1,189 @@
+# Query execution for SQL Snippets.
+# Snippets run on a pool of read-only connections, one per gunicorn thread, so concurrent
+# runs don't share a connection and a snippet can't modify the database.
+# Each query has a time limit, enforced with a SQLite progress handler.
+# Results are fetched a chunk at a time and stop at a row and byte limit, so a
+# SELECT * on a large table can't use up the server's memory.
+# Runs can be timed and their query plans checked for full table scans.
+from __future__ import annotations
+import os
+import queue
+import re
+import sqlite3 as db
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+import pandas as pd
+
+# The progress handler is called every this many SQLite virtual machine instructions
+PROGRESS_INSTRUCTIONS = 10000
+
+# Rows are fetched this many at a time
+FETCH_SIZE = 1000
+
+class QueryTimeout(Exception):
+    pass
+
+def connect_read_only(path: str) -> db.Connection:
+    """Opens a read-only connection. Writes fail with "attempt to write a readonly database"."""
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+    return db.connect(uri, uri=True, check_same_thread=False)
+
+class ConnectionPool:
+    """A bounded pool of read-only connections to one database"""
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.connections = queue.Queue(maxsize=size)
+
+        for _ in range(size):
+            self.connections.put(connect_read_only(path))
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection, waiting for one to be returned if they are all in use"""
+        conn = self.connections.get()
+
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def read_sql_query(self, sql: str, timeout: float | None = None) -> pd.DataFrame:
+        with self.connection() as conn:
+            return read_sql_query(conn, sql, timeout)
+
+    def fetch_dataframe(self, sql: str, timeout: float | None = None, max_rows: int | None = None, max_bytes: int | None = None, stats: dict | None = None) -> tuple[pd.DataFrame, bool]:
+        with self.connection() as conn:
+            return fetch_dataframe(conn, sql, timeout, max_rows, max_bytes, stats)
+
+    def explain(self, sql: str) -> list[str]:
+        with self.connection() as conn:
+            return explain(conn, sql)
+
+    def close(self) -> None:
+        while not self.connections.empty():
+            self.connections.get().close()
+
+class QueryProgress:
+    def __init__(self):
+        # Virtual machine instructions run so far, in steps of PROGRESS_INSTRUCTIONS. SQLite doesn't
+        # report rows scanned to Python, so this is the measure of how much work a query did.
+        self.instructions = 0
+
+@contextmanager
+def time_limit(conn: db.Connection, timeout: float | None):
+    """Interrupts the queries run on conn inside the block once timeout seconds have passed.
+    Yields a QueryProgress that counts the work done."""
+    progress = QueryProgress()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    timed_out = False
+
+    def check_deadline() -> int:
+        nonlocal timed_out
+        progress.instructions += PROGRESS_INSTRUCTIONS
+        timed_out = deadline is not None and time.monotonic() > deadline
+
+        # A non-zero return value stops the query
+        return 1 if timed_out else 0
+
+    conn.set_progress_handler(check_deadline, PROGRESS_INSTRUCTIONS)
+
+    try:
+        yield progress
+    except (db.OperationalError, pd.errors.DatabaseError) as e:
+        # pandas wraps the "interrupted" error in its own DatabaseError
+        if timed_out:
+            raise QueryTimeout(f"Query took longer than {timeout:g}s") from e
+
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+def read_sql_query(conn: db.Connection, sql: str, timeout: float | None = None) -> pd.DataFrame:
+    with time_limit(conn, timeout):
+        return pd.read_sql_query(sql, conn)
+
+def fetch_dataframe(conn: db.Connection, sql: str, timeout: float | None = None, max_rows: int | None = None, max_bytes: int | None = None, stats: dict | None = None) -> tuple[pd.DataFrame, bool]:
+    """Fetches the result FETCH_SIZE rows at a time until it ends or reaches max_rows or about max_bytes (checked after each fetch).
+    Returns the rows that were fetched and whether the result was cut short. If given, stats is filled in with the
+    wall time in seconds and the instructions run."""
+    start = time.perf_counter()
+
+    with time_limit(conn, timeout) as progress:
+        cursor = conn.execute(sql)
+
+        try:
+            # Statements that return no rows have no description
+            columns = [column[0] for column in cursor.description or []]
+            chunks = []
+            rows = 0
+            size = 0
+            truncated = False
+
+            while True:
+                fetch_size = FETCH_SIZE if max_rows is None else min(FETCH_SIZE, max_rows - rows + 1)
+                records = cursor.fetchmany(fetch_size)
+
+                if not records:
+                    break
+
+                chunk = pd.DataFrame.from_records(records, columns=columns, coerce_float=True)
+
+                # Fetching one row past max_rows tells whether there is more
+                if max_rows is not None and rows + len(chunk) > max_rows:
+                    chunk = chunk.iloc[:max_rows - rows]
+                    truncated = True
+
+                chunks.append(chunk)
+                rows += len(chunk)
+                size += int(chunk.memory_usage(deep=True).sum())
+
+                if truncated or (max_bytes is not None and size >= max_bytes):
+                    truncated = truncated or cursor.fetchone() is not None
+                    break
+        finally:
+            cursor.close()
+
+            if stats is not None:
+                stats['seconds'] = time.perf_counter() - start
+                stats['instructions'] = progress.instructions
+
+    if not chunks:
+        return pd.DataFrame(columns=columns), False
+
+    return pd.concat(chunks, ignore_index=True), truncated
+
+def page_count(num_rows: int, page_size: int) -> int:
+    return max(1, -(-num_rows // page_size))
+
+def explain(conn: db.Connection, sql: str) -> list[str]:
+    """The steps of the query plan, indented by depth"""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    depths = {0: -1}
+    steps = []
+
+    for id, parent, _, detail in rows:
+        depths[id] = depths.get(parent, -1) + 1
+        steps.append("  " * depths[id] + detail)
+
+    return steps
+
+# SCAN steps, "SCAN TABLE t" before SQLite 3.36
+FULL_SCAN = re.compile(r"^\s*SCAN (?:TABLE )?(.+)$")
+
+def avoidable_scans(sql: str, plan: list[str]) -> list[str]:
+    """Tables (or their aliases) read in full by a query that filters, joins, groups or sorts them, where an index could help.
+    A query without any of those has to read the whole table anyway."""
+    if not re.search(r"\b(where|join|group by|order by)\b", sql, re.IGNORECASE):
+        return []
+
+    tables = []
+
+    for match in map(FULL_SCAN.match, plan):
+        # Scans through an index, of a constant row or of a subquery's result aren't table scans
+        if match is not None and " USING " not in match.group(1) and not match.group(1).startswith(("CONSTANT ROW", "(")):
+            tables.append(match.group(1))
+
+    return tables
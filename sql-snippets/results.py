@@ -0,0 +1,118 @@
+# On-disk result format for SQL Snippets.
+# Results are stored as Arrow IPC files, written in record batches of one page each, with
+# the row count and whether the result was truncated in the schema metadata. Files are
+# memory-mapped on read, so the row count or a single page can be read without loading
+# the whole result.
+# Arrow needs unique column names, so repeated ones (e.g. SELECT * over a join) are stored
+# with a suffix, CustomerID and CustomerID_2, and the original names are restored on read.
+from __future__ import annotations
+import json
+import os
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+
+# Rows per record batch. Pages that line up with batches are read from a single batch.
+BATCH_SIZE = 100
+
+def unique_names(names: list) -> list[str]:
+    seen = set()
+    unique = []
+
+    for name in map(str, names):
+        candidate = name
+        n = 1
+
+        while candidate in seen:
+            n += 1
+            candidate = f"{name}_{n}"
+
+        seen.add(candidate)
+        unique.append(candidate)
+
+    return unique
+
+def column_names(schema: pa.Schema) -> list[str]:
+    """The result's column names, including any repeated ones"""
+    metadata = schema.metadata or {}
+
+    return json.loads(metadata[b"columns"]) if b"columns" in metadata else schema.names
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    df = table.to_pandas()
+    df.columns = column_names(table.schema)
+
+    return df
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    if not df.columns.is_unique:
+        df = df.set_axis(unique_names(df.columns), axis=1)
+
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # SQLite columns can mix types, e.g. numbers and text, which an Arrow column can't hold
+        mixed = df.copy()
+
+        for name in mixed.columns:
+            if mixed[name].dtype == object:
+                mixed[name] = mixed[name].map(lambda value: value if value is None or isinstance(value, (str, bytes)) else str(value))
+
+        return pa.Table.from_pandas(mixed, preserve_index=False)
+
+def write_result(path: str, df: pd.DataFrame, truncated: bool = False) -> None:
+    table = to_arrow(df)
+    metadata = {**(table.schema.metadata or {}), b"row_count": str(len(df)).encode(), b"truncated": b"1" if truncated else b"0"}
+
+    if not df.columns.is_unique:
+        metadata[b"columns"] = json.dumps([str(name) for name in df.columns]).encode()
+
+    table = table.replace_schema_metadata(metadata)
+
+    # Write to a temporary file first so readers never see a partial file
+    temporary = f"{path}.{threading.get_ident()}.tmp"
+
+    with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=BATCH_SIZE)
+
+    os.replace(temporary, path)
+
+def copy_result(source: str, path: str) -> None:
+    """Copies a result file, replacing path the same way as write_result. Raises FileNotFoundError if source is gone."""
+    temporary = f"{path}.{threading.get_ident()}.tmp"
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, path)
+
+def open_result(path: str) -> pa.ipc.RecordBatchFileReader:
+    return pa.ipc.open_file(pa.memory_map(path, "r"))
+
+def read_info(path: str) -> dict:
+    """Row count, column names and truncation of a result, read from the file footer"""
+    schema = open_result(path).schema
+    metadata = schema.metadata or {}
+
+    return {'row_count': int(metadata.get(b"row_count", b"0")), 'columns': column_names(schema), 'truncated': metadata.get(b"truncated") == b"1"}
+
+def read_page(path: str, page_number: int, page_size: int) -> pd.DataFrame:
+    """Returns page page_number (starting at 1) of the result. Only the record batches holding the page are read."""
+    reader = open_result(path)
+    start = (page_number - 1) * page_size
+    batches = []
+    offset = 0
+
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+
+        if offset + batch.num_rows > start and offset < start + page_size:
+            batches.append(batch.slice(max(0, start - offset), start + page_size - max(offset, start)))
+
+        offset += batch.num_rows
+
+        if offset >= start + page_size:
+            break
+
+    return to_pandas(pa.Table.from_batches(batches, schema=reader.schema))
+
+def read_result(path: str) -> pd.DataFrame:
+    return to_pandas(open_result(path).read_all())
@@ -0,0 +1,78 @@
+# Scheduled snippet runs for SQL Snippets.
+# Snippets can be re-run on a schedule so viewers see a precomputed result instead of
+# running the query themselves. A background thread checks every few seconds which
+# snippets are due and hands them to a callback. First runs are spread over the interval,
+# so snippets with the same schedule don't all run at once after a restart.
+from __future__ import annotations
+import threading
+import time
+import traceback
+import zlib
+
+# Refresh options shown on the snippet form, in seconds
+SCHEDULES = {
+    "Never": None,
+    "Every 15 minutes": 15 * 60,
+    "Hourly": 60 * 60,
+    "Daily": 24 * 60 * 60,
+}
+
+class Scheduler:
+    def __init__(self, run, check_every: float = 10):
+        # run(snippet_id) is called when a snippet is due
+        self.run = run
+        self.check_every = check_every
+        # snippet id -> (interval in seconds, next run time)
+        self.schedules = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def set(self, snippet_id: str, schedule: str | None) -> None:
+        """Schedules a snippet with one of SCHEDULES, or unschedules it"""
+        interval = SCHEDULES.get(schedule)
+
+        with self.lock:
+            if interval is None:
+                self.schedules.pop(snippet_id, None)
+            elif snippet_id not in self.schedules or self.schedules[snippet_id][0] != interval:
+                # A stable offset within the interval, from the snippet id
+                offset = zlib.crc32(snippet_id.encode()) % interval
+                self.schedules[snippet_id] = (interval, time.time() + offset)
+
+    def scheduled(self) -> dict:
+        """Snippet id -> schedule name"""
+        names = {interval: name for name, interval in SCHEDULES.items()}
+
+        with self.lock:
+            return {snippet_id: names[interval] for snippet_id, (interval, _) in self.schedules.items()}
+
+    def due(self, now: float) -> list[str]:
+        with self.lock:
+            due = [snippet_id for snippet_id, (interval, next_run) in self.schedules.items() if next_run <= now]
+
+            for snippet_id in due:
+                interval, next_run = self.schedules[snippet_id]
+                # Skip runs missed while the app was busy or down rather than catching up
+                while next_run <= now:
+                    next_run += interval
+
+                self.schedules[snippet_id] = (interval, next_run)
+
+        return due
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, name="scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def loop(self) -> None:
+        while not self.stop_event.wait(self.check_every):
+            for snippet_id in self.due(time.time()):
+                try:
+                    self.run(snippet_id)
+                except Exception:
+                    traceback.print_exc()